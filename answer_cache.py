@@ -0,0 +1,87 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from sparse_index import tokenize
+
+
+def key_terms(text):
+    # part numbers, error codes and versions ("E1042", "sku-00042", "v2.1"): embeddings barely move when
+    # they change, but a question about another one needs another answer
+    return frozenset(term for term in tokenize(text or "") if any(char.isdigit() for char in term))
+
+
+# Per-agent semantic cache of answers. Entries are keyed by the embedding of the standalone
+# question; a lookup returns the entry with the highest cosine similarity that clears the
+# threshold and whose question names the same codes and numbers (key_terms). Expired entries (ttl seconds) are dropped on lookup and the least recently used
+# entry is evicted once max_entries is reached.
+class SemanticAnswerCache:
+    def __init__(self, threshold=0.95, ttl=86400, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+        self._matrix = None
+        self._matrix_ids = []
+        self._lock = threading.Lock()
+
+    def _vector_index(self):
+        # rows of unit vectors, rebuilt lazily after the entries change
+        if self._matrix is None:
+            self._matrix_ids = list(self.entries)
+            if self._matrix_ids:
+                self._matrix = np.stack([self.entries[i]["vector"] for i in self._matrix_ids])
+            else:
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+        return self._matrix, self._matrix_ids
+
+    def _expire(self):
+        now = time.time()
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry["created"] > self.ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, vector, question=None):
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        terms = key_terms(question)
+        with self._lock:
+            self._expire()
+            matrix, ids = self._vector_index()
+            best = None
+            if ids:
+                scores = matrix @ query
+                for row in np.argsort(-scores, kind="stable"):
+                    if scores[row] < self.threshold:
+                        break
+                    if self.entries[ids[row]]["terms"] == terms:
+                        best = ids[row]
+                        break
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best)
+            entry = self.entries[best]
+            return entry["answer"], entry["references"]
+
+    def add(self, vector, answer, references, question=None):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            while len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+            self.entries[self._next_id] = {"vector": vector, "answer": answer, "references": references,
+                                           "terms": key_terms(question), "created": time.time()}
+            self._next_id += 1
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._matrix = None
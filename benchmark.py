@@ -0,0 +1,476 @@
+# Offline retrieval + latency benchmark
+# Runs the real ingestion and chat code paths (get_chunks, get_vector_db, get_conversation_chain,
+# handle_user_question, get_unique_references) against local stand-ins: hash embeddings,
+# a FAISS index in a temp dir and a canned-response chat model. No OpenAI or Pinecone keys needed.
+#
+# Command to run >> python benchmark.py --sizes 10 100 1000 --save bench.json
+# Command to compare >> python benchmark.py --sizes 10 100 1000 --compare bench.json
+# Command for the vector storage report >> python benchmark.py --sizes 2000 --storage-report
+# Command for the cold-start report >> python benchmark.py --import-report --save startup.json
+# Command for the embedding scheduler check >> python benchmark.py --scheduler-check
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(REPO_DIR, ".cache", "bench")
+# FAISS storage variants compared by --storage-report; rerank_factor 1 ranks only the first k candidates
+STORAGE_VARIANTS = [{"storage": "float32"},
+                    {"storage": "float16", "rerank_factor": 1}, {"storage": "float16"},
+                    {"storage": "int8", "rerank_factor": 1}, {"storage": "int8"},
+                    {"storage": "pq", "rerank_factor": 1}, {"storage": "pq"},
+                    {"storage": "float16", "truncate_dim": 512}, {"storage": "int8", "truncate_dim": 256}]
+# entry points timed by --import-report, and modules none of them should load before first use
+APP_SCRIPTS = ["streamlit_app.py", "db_creator_app.py", "data_analysis.py"]
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_community", "lida", "pandas", "faiss", "torch", "openai")
+# metric -> True when higher is better
+TRACKED_METRICS = {"chunks_per_sec": True, "pdfs_per_sec": True, "recall": True,
+                   "p50_ms": False, "p95_ms": False, "p99_ms": False, "peak_rss_mb": False}
+
+
+#### SYNTHETIC CORPUS ####
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    # minimal single-font PDF, one content stream per page, readable by PyPDFLoader
+    page_count = len(pages)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + 2 * i} 0 R" for i in range(page_count)), page_count),
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, lines in enumerate(pages):
+        content = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+    out = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(out)
+
+
+def make_corpus(pdf_count, pages_per_pdf=1, lines_per_page=40, seed=0):
+    # one fact per PDF ("SKU-00042 is handled by team ...") gives a question with a known source
+    corpus_dir = os.path.join(CORPUS_DIR, f"corpus-{pdf_count}-{pages_per_pdf}-{lines_per_page}-{seed}")
+    questions_path = os.path.join(corpus_dir, "questions.json")
+    if os.path.exists(questions_path):
+        return corpus_dir, questions_path
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+                  for _ in range(2000)]
+    pdf_dir = os.path.join(corpus_dir, "pdfs")
+    os.makedirs(pdf_dir, exist_ok=True)
+    questions = []
+    for i in range(pdf_count):
+        team = rng.choice(vocabulary)
+        pages = [[" ".join(rng.choice(vocabulary) for _ in range(12)) for _ in range(lines_per_page)]
+                 for _ in range(pages_per_pdf)]
+        pages[0][rng.randrange(lines_per_page)] = f"Product code SKU-{i:05d} is handled by team {team}."
+        filename = f"doc-{i:05d}.pdf"
+        write_pdf(os.path.join(pdf_dir, filename), pages)
+        questions.append({"question": f"Which team handles product code SKU-{i:05d}?", "source": filename})
+    with open(questions_path, "w") as f:
+        json.dump(questions, f)
+    return corpus_dir, questions_path
+
+
+#### ONE CORPUS, INSIDE A STREAMLIT SCRIPT CONTEXT ####
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux; children covers the PDF parsing process pool
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def held_out_queries(local_index, count, seed=0, span_words=8):
+    # a run of words cut from a random chunk: the words are distinct enough in the synthetic corpus
+    # that exact search ranks the chunk they came from first, unlike the SKU questions, whose
+    # answer chunk ties with every other "Product code ... is handled by team" line
+    rng = random.Random(seed)
+    queries = []
+    live = [row for row, vector_id in enumerate(local_index.ids) if vector_id is not None]
+    for row in rng.sample(live, min(count, len(live))):
+        words = local_index.metadatas[row].get("text", "").split()
+        start = rng.randrange(max(1, len(words) - span_words + 1))
+        queries.append((" ".join(words[start:start + span_words]), row))
+    return queries
+
+
+def storage_report(index_name, query_count, k=3, seed=0):
+    # rebuilds the agent's index in every storage variant from its float32 vectors and measures
+    # recall@k against exact search, how often the query's own chunk is found, search latency and size
+    import numpy as np
+    import faiss
+    from resources import get_backend, get_embeddings
+    from vector_store import LocalFaissIndex, build_faiss_index, truncate_vectors, normalize
+    from faiss_store import make_faiss_store
+    local_index = LocalFaissIndex(get_backend().local_path(index_name))
+    vectors = normalize(local_index.load_vectors())
+    embeddings = get_embeddings()
+    queries = held_out_queries(local_index, query_count, seed)
+    query_vectors = [embeddings.embed_query(text) for text, _ in queries]
+    rows_by_key = {(metadata.get("source"), metadata.get("text")): row
+                   for row, metadata in enumerate(local_index.metadatas) if metadata is not None}
+    # exact top k by brute force over the float32 rows, ties broken by row number (plain float32 FAISS
+    # orders ties its own way, so it can fall just short of 1.0 where unrelated chunks tie at rank k)
+    exact_rows = []
+    for query_vector in normalize(query_vectors):
+        scores = vectors @ query_vector
+        exact_rows.append(set(np.lexsort((np.arange(len(scores)), -scores))[:k].tolist()))
+    exact_hits = sum(row in exact for (_, row), exact in zip(queries, exact_rows))
+    report = []
+    for variant in STORAGE_VARIANTS:
+        config = {**local_index.config, "truncate_dim": None, "rerank_factor": 4, **variant}
+        started = time.perf_counter()
+        index = build_faiss_index(truncate_vectors(vectors, config["truncate_dim"]), config["index_type"],
+                                  config.get("ivf_nlist", 1024), config.get("hnsw_m", 32), config["storage"],
+                                  config.get("pq_m", 96))
+        build_s = time.perf_counter() - started
+        vector_db = make_faiss_store(embeddings, index, local_index, config)
+        latencies, found = [], []
+        for query_vector in query_vectors:
+            started = time.perf_counter()
+            docs = vector_db.similarity_search_with_score_by_vector(query_vector, k=k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found.append({rows_by_key.get((doc.metadata.get("source"), doc.page_content)) for doc, _ in docs})
+        overlap = sum(len(rows & exact) for rows, exact in zip(found, exact_rows))
+        hits = sum(row in rows for (_, row), rows in zip(queries, found))
+        report.append({"storage": config["storage"], "dim": config["truncate_dim"] or vectors.shape[1],
+                       "rerank": config["rerank_factor"],
+                       "recall_at_k": round(overlap / max(1, k * len(queries)), 3),
+                       "chunk_hits": round(hits / max(1, len(queries)), 3),
+                       "exact_hits": round(exact_hits / max(1, len(queries)), 3),
+                       "p50_ms": round(percentile(latencies, 50), 3), "p95_ms": round(percentile(latencies, 95), 3),
+                       "index_mb": round(faiss.serialize_index(index).nbytes / 2 ** 20, 2),
+                       "build_s": round(build_s, 2)})
+    return report
+
+
+def scheduler_check(chunks=400, batch_size=8, concurrency=4, rate_limit_every=5, retry_after=0.05):
+    # runs EmbeddingScheduler against the fake backend, which answers every rate_limit_every-th request
+    # with a 429 and Retry-After, and checks that batches come back complete, in order, and retried
+    from langchain.schema import Document
+    from embedding_engine import EmbeddingScheduler, make_fake_embed_fn
+    texts = [f"chunk {i} of the scheduler check" for i in range(chunks)]
+    expected = make_fake_embed_fn(dimension=8)(texts)
+    failures = []
+    for method in ("iter_embed", "embed_texts"):
+        scheduler = EmbeddingScheduler(make_fake_embed_fn(dimension=8, latency=0.005, rate_limit_every=rate_limit_every,
+                                                          retry_after=retry_after),
+                                       batch_size=batch_size, max_concurrency=concurrency, base_delay=0.01)
+        started = time.perf_counter()
+        if method == "iter_embed":
+            results = list(scheduler.iter_embed(Document(page_content=text) for text in texts))
+            order = [doc.page_content for batch, _ in results for doc in batch]
+            vectors = [vector for _, batch_vectors in results for vector in batch_vectors]
+        else:
+            vectors = scheduler.embed_texts(texts)
+            order = texts
+        elapsed = time.perf_counter() - started
+        # every rate_limit_every-th request fails, so the batches take this many requests in total
+        batches = -(-chunks // batch_size)
+        requests = batches + (batches - 1) // (rate_limit_every - 1)
+        expected_retries = requests // rate_limit_every
+        stats = scheduler.stats
+        checks = {"order": order == texts, "vectors": vectors == expected, "chunks": stats.chunks == chunks,
+                  "retries": stats.retries == expected_retries, "rate_limited": stats.rate_limited == expected_retries,
+                  "paused": elapsed >= retry_after}
+        print(f"{method:<12} {stats.retries} retries ({stats.rate_limited} rate limited, expected {expected_retries}) "
+              f"in {elapsed:.2f}s  " + "  ".join(f"{name}={'ok' if ok else 'FAIL'}" for name, ok in checks.items()))
+        failures += [f"{method}: {name}" for name, ok in checks.items() if not ok]
+    return failures
+
+
+def run_corpus(config):
+    import streamlit as st
+    import db_creator_app
+    import streamlit_app
+    from warmup import import_modules
+
+    # the apps load these in the background after their first page; loading them here keeps
+    # import time out of the ingestion and query timings (see --import-report for it)
+    import_modules(db_creator_app.WARMUP_MODULES + streamlit_app.WARMUP_MODULES + ["fakes"])
+    st.session_state.password = os.environ["APP_PASSWORD"]
+    chunk_count = {"n": 0}
+
+    def counted(chunks):
+        for chunk in chunks:
+            chunk_count["n"] += 1
+            yield chunk
+
+    started = time.perf_counter()
+    text_chunks = db_creator_app.get_chunks(os.path.join(config["corpus_dir"], "pdfs"))
+    db_creator_app.get_vector_db(counted(text_chunks), "bench")
+    ingest_s = time.perf_counter() - started
+
+    streamlit_app.initialize_session_state()
+    st.session_state.chain = streamlit_app.get_conversation_chain("bench")
+    if config.get("storage_report"):
+        return {"pdfs": config["pdfs"], "chunks": chunk_count["n"],
+                "storage": storage_report("bench", config["queries"], seed=config["seed"])}
+    with open(config["questions_path"]) as f:
+        questions = json.load(f)
+    rng = random.Random(config["seed"])
+    questions = [rng.choice(questions) for _ in range(config["queries"])]
+    latencies, found = [], 0
+    for item in questions:
+        # every question is a first turn, so latency does not depend on the order of questions
+        st.session_state.chain.memory.clear()
+        started = time.perf_counter()
+        streamlit_app.handle_user_question(item["question"])
+        latencies.append((time.perf_counter() - started) * 1000)
+        found += item["source"] in st.session_state["generated"][-1]
+    return {"pdfs": config["pdfs"], "chunks": chunk_count["n"], "ingest_s": round(ingest_s, 2),
+            "chunks_per_sec": round(chunk_count["n"] / ingest_s, 1),
+            "pdfs_per_sec": round(config["pdfs"] / ingest_s, 1),
+            "queries": len(latencies),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "recall": round(found / max(1, len(questions)), 3),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def app_script():
+    # body is run by AppTest as a Streamlit script, so st.session_state and the caches behave as in the apps
+    import sys
+    import streamlit as st
+    config = st.session_state["bench_config"]
+    sys.path.insert(0, config["repo_dir"])
+    import benchmark
+    st.session_state["bench_result"] = benchmark.run_corpus(config)
+
+
+def run_one(config):
+    from streamlit.testing.v1 import AppTest
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({"APP_PASSWORD": "bench", "VECTOR_STORE": "faiss",
+                       "FAISS_DIR": os.path.join(work_dir, "indexes"),
+                       "EMBED_CACHE_DIR": os.path.join(work_dir, "embeddings"),
+                       "EMBEDDINGS_BACKEND": "fake", "LLM_BACKEND": "fake", "STREAMING": "false",
+                       "FAKE_LLM_FIRST_TOKEN_DELAY": str(config["llm_delay"]), "FAKE_LLM_TOKEN_DELAY": "0",
+                       "ANSWER_CACHE": "false", "TRACE_EXPORT": "none"})
+    os.environ.update(config["env"])
+    os.chdir(work_dir)
+    try:
+        app = AppTest.from_function(app_script, default_timeout=config["timeout"])
+        app.session_state["bench_config"] = config
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+        return app.session_state["bench_result"]
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+#### COLD START ####
+def run_startup(app):
+    # in a fresh process: import streamlit, then time the app's first script run (its own imports and
+    # the first page) with background warm-up off, and list the heavy modules that run loaded
+    work_dir = tempfile.mkdtemp(prefix="startup-")
+    os.environ.update({"APP_PASSWORD": "bench", "VECTOR_STORE": "faiss", "FAISS_DIR": os.path.join(work_dir, "indexes"),
+                       "EMBEDDINGS_BACKEND": "fake", "LLM_BACKEND": "fake", "TRACE_EXPORT": "none",
+                       "WARMUP": "false", "JOBS_DIR": os.path.join(work_dir, "jobs")})
+    os.chdir(work_dir)
+    try:
+        started = time.perf_counter()
+        from streamlit.testing.v1 import AppTest
+        streamlit_ms = (time.perf_counter() - started) * 1000
+        app_test = AppTest.from_file(os.path.join(REPO_DIR, app), default_timeout=120)
+        app_test.secrets["APP_PASSWORD"] = "bench"
+        started = time.perf_counter()
+        app_test.run()
+        first_run_ms = (time.perf_counter() - started) * 1000
+        if app_test.exception:
+            raise RuntimeError(app_test.exception[0].value)
+        heavy = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+        return {"app": app, "streamlit_ms": round(streamlit_ms, 1), "first_run_ms": round(first_run_ms, 1),
+                "heavy_modules": heavy}
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def startup_report(repeat):
+    results = []
+    for app in APP_SCRIPTS:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--startup-one", app],
+                                    capture_output=True, text=True, cwd=REPO_DIR)
+            if output.returncode != 0:
+                print(output.stdout[-5000:], output.stderr[-5000:], sep="\n", file=sys.stderr)
+                sys.exit(f"startup run for {app} failed")
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        # median of fresh processes; the page cache makes the first one slower
+        runs.sort(key=lambda run: run["first_run_ms"])
+        results.append(runs[len(runs) // 2])
+    return results
+
+
+def compare_startup(results, baseline, tolerance):
+    regressions = []
+    baseline_by_app = {row["app"]: row for row in baseline}
+    for row in results:
+        old = baseline_by_app.get(row["app"])
+        if old is None:
+            continue
+        change = (row["first_run_ms"] - old["first_run_ms"]) / old["first_run_ms"]
+        new_modules = sorted(set(row["heavy_modules"]) - set(old["heavy_modules"]))
+        marker = "REGRESSION" if change > tolerance or new_modules else ""
+        print(f"{row['app']:<18} first_run_ms {old['first_run_ms']:>10} -> {row['first_run_ms']:>10}  {change:+.1%}"
+              + (f"  now loads {', '.join(new_modules)}" if new_modules else "") + f" {marker}")
+        if marker:
+            regressions.append((row["app"], "first_run_ms"))
+    return regressions
+
+
+def print_startup_table(results):
+    print(f"{'app':<18}  {'streamlit_ms':>12}  {'first_run_ms':>12}  heavy_modules")
+    for row in results:
+        print(f"{row['app']:<18}  {row['streamlit_ms']:>12}  {row['first_run_ms']:>12}  "
+              f"{', '.join(row['heavy_modules']) or '-'}")
+
+
+#### DRIVER ####
+def compare(results, baseline, tolerance):
+    regressions = []
+    baseline_by_size = {row["pdfs"]: row for row in baseline}
+    for row in results:
+        old = baseline_by_size.get(row["pdfs"])
+        if old is None:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            if not old.get(metric) or metric not in row:
+                continue
+            change = (row[metric] - old[metric]) / old[metric]
+            worse = -change if higher_is_better else change
+            marker = "REGRESSION" if worse > tolerance else ""
+            print(f"{row['pdfs']:>6} pdfs  {metric:<15} {old[metric]:>10} -> {row[metric]:>10}  {change:+.1%} {marker}")
+            if marker:
+                regressions.append((row["pdfs"], metric))
+    return regressions
+
+
+def print_storage_table(results):
+    columns = ["storage", "dim", "rerank", "recall_at_k", "chunk_hits", "exact_hits", "p50_ms", "p95_ms", "index_mb",
+               "build_s"]
+    for result in results:
+        print(f"{result['pdfs']} pdfs, {result['chunks']} chunks")
+        print("  ".join(f"{column:>15}" for column in columns))
+        for row in result["storage"]:
+            print("  ".join(f"{str(row[column]):>15}" for column in columns))
+
+
+def print_table(results):
+    columns = ["pdfs", "chunks", "ingest_s", "chunks_per_sec", "pdfs_per_sec", "p50_ms", "p95_ms", "p99_ms",
+               "recall", "peak_rss_mb"]
+    print("  ".join(f"{column:>14}" for column in columns))
+    for row in results:
+        print("  ".join(f"{row[column]:>14}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="PDF counts (up to 10000)")
+    parser.add_argument("--pages", type=int, default=1, help="pages per synthetic PDF")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="fake LLM latency in seconds")
+    parser.add_argument("--env", nargs="*", default=[], help="extra settings, e.g. RETRIEVER_MODE=dense")
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file from an earlier --save")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    parser.add_argument("--storage-report", action="store_true",
+                        help="compare FAISS float32/float16/int8/PQ/truncated storage instead of the query benchmark")
+    parser.add_argument("--import-report", action="store_true",
+                        help="time each app's cold start (imports + first page) instead of the query benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per app for --import-report")
+    parser.add_argument("--scheduler-check", action="store_true",
+                        help="check embedding batching, ordering and 429 retries against the fake backend")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--startup-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+    if args.startup_one:
+        print(json.dumps(run_startup(args.startup_one)))
+        return
+    if args.scheduler_check:
+        failures = scheduler_check()
+        if failures:
+            sys.exit("scheduler check failed: " + ", ".join(failures))
+        return
+    if args.import_report:
+        results = startup_report(args.repeat)
+        print_startup_table(results)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                if compare_startup(results, json.load(f), args.tolerance):
+                    sys.exit(1)
+        return
+
+    results = []
+    for size in args.sizes:
+        corpus_dir, questions_path = make_corpus(size, pages_per_pdf=args.pages, seed=args.seed)
+        config = {"repo_dir": REPO_DIR, "corpus_dir": corpus_dir, "questions_path": questions_path,
+                  "pdfs": size, "queries": args.queries, "seed": args.seed, "llm_delay": args.llm_delay,
+                  "timeout": args.timeout, "env": dict(item.split("=", 1) for item in args.env),
+                  "storage_report": args.storage_report}
+        # a fresh process per corpus keeps the memory high-water mark per corpus size
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config)],
+                                capture_output=True, text=True, cwd=REPO_DIR)
+        if output.returncode != 0:
+            print(output.stdout[-5000:], output.stderr[-5000:], sep="\n", file=sys.stderr)
+            sys.exit(f"benchmark run for {size} pdfs failed")
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        print(f"finished {size} pdfs", file=sys.stderr)
+    if args.storage_report:
+        print_storage_table(results)
+    else:
+        print_table(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import re
+import time
+import hashlib
+from collections import Counter
+import numpy as np
+from sparse_index import tokenize
+from tracing import record_span
+
+# Token-aware chunking with boilerplate stripping and duplicate removal, applied before embedding.
+# Headers and footers that repeat across most pages of a file are dropped from the pages, then
+# chunks whose normalized text was already seen (exact) or whose 64-bit SimHash is within
+# max_distance bits of an earlier chunk (near duplicate) of the same file are skipped.
+# Duplicates are only looked for within a file: a copy kept from another file would take the
+# content with it when that file is changed or removed in an update.
+
+SHINGLE_SIZE = 3
+MIN_NEAR_DUP_WORDS = 8
+PAGE_NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def make_token_splitter(count_tokens, chunk_tokens=128, overlap_tokens=16):
+    # same recursive separators as before, measured in embedding-model tokens instead of characters
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_tokens, chunk_overlap=overlap_tokens,
+                                          length_function=count_tokens)
+
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+def boilerplate_key(line):
+    # "Page 3 of 12" and "Page 4 of 12" are the same footer
+    return PAGE_NUMBER_PATTERN.sub("#", normalize_text(line))
+
+
+def simhash(words):
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))]
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+                       for shingle in shingles], dtype=">u8")
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(len(shingles), 64)
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(shingles))
+    return int.from_bytes(fingerprint.tobytes(), "big")
+
+
+class ChunkCleaner:
+    def __init__(self, count_tokens, strip_boilerplate=True, dedup=True, max_distance=3,
+                 edge_lines=3, min_pages=3, min_share=0.5):
+        self.count_tokens = count_tokens
+        self.strip_boilerplate = strip_boilerplate
+        self.dedup = dedup
+        self.max_distance = max_distance
+        self.edge_lines = edge_lines
+        self.min_pages = min_pages
+        self.min_share = min_share
+        # with max_distance + 1 bands, two fingerprints within max_distance bits share at least one band
+        self.band_count = max_distance + 1
+        self.band_bits = 64 // self.band_count
+        # doc_id -> (seen normalized texts, bands)
+        self.seen = {}
+        self.stats = Counter()
+
+    # pages: the pages of one file; repeated lines near the top or bottom of a page are removed.
+    # Pages with fewer than 2 * edge_lines lines have no separate header and footer and are left as is.
+    def clean_pages(self, pages):
+        if not self.strip_boilerplate:
+            return pages
+        page_lines = {}
+        for page in pages:
+            lines = page.page_content.splitlines()
+            if sum(1 for line in lines if line.strip()) >= 2 * self.edge_lines:
+                page_lines[id(page)] = lines
+        if len(page_lines) < self.min_pages:
+            return pages
+        started = time.perf_counter()
+        counts = Counter()
+        for lines in page_lines.values():
+            edges = [line for line in lines if line.strip()]
+            edges = edges[:self.edge_lines] + edges[-self.edge_lines:]
+            counts.update({boilerplate_key(line) for line in edges})
+        repeated = {key for key, count in counts.items() if count >= self.min_share * len(page_lines)}
+        if not repeated:
+            return pages
+        for page in pages:
+            if id(page) not in page_lines:
+                continue
+            lines = page_lines[id(page)]
+            kept = []
+            for line in lines:
+                if line.strip() and boilerplate_key(line) in repeated:
+                    self.stats["boilerplate_lines"] += 1
+                    self.stats["boilerplate_tokens"] += self.count_tokens(line)
+                else:
+                    kept.append(line)
+            page.page_content = "\n".join(kept)
+        record_span("boilerplate", time.perf_counter() - started, pages=len(pages), repeated_lines=len(repeated))
+        return pages
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(self.band_count)]
+
+    # file: the doc_id of the chunk's file; only earlier chunks of the same file count
+    def is_duplicate(self, text, file=None):
+        seen_texts, bands = self.seen.setdefault(file, (set(), [{} for _ in range(self.band_count)]))
+        normalized = normalize_text(text)
+        if normalized in seen_texts:
+            return "exact"
+        seen_texts.add(normalized)
+        words = tokenize(normalized)
+        if len(words) < MIN_NEAR_DUP_WORDS:
+            return None
+        fingerprint = simhash(words)
+        keys = self._band_keys(fingerprint)
+        for band, key in zip(bands, keys):
+            for other in band.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return "near"
+        for band, key in zip(bands, keys):
+            band.setdefault(key, []).append(fingerprint)
+        return None
+
+    def filter(self, chunks):
+        for chunk in chunks:
+            self.stats["chunks"] += 1
+            file = chunk.metadata.get("doc_id", chunk.metadata.get("source"))
+            duplicate = self.is_duplicate(chunk.page_content, file) if self.dedup else None
+            if duplicate is not None:
+                self.stats[f"{duplicate}_duplicates"] += 1
+                self.stats["duplicate_tokens"] += self.count_tokens(chunk.page_content)
+                continue
+            self.stats["kept"] += 1
+            yield chunk
+
+    def summary(self):
+        removed = self.stats["exact_duplicates"] + self.stats["near_duplicates"]
+        return (f"Chunking removed {removed} of {self.stats['chunks']} chunks "
+                f"({self.stats['exact_duplicates']} exact, {self.stats['near_duplicates']} near duplicates, "
+                f"{self.stats['duplicate_tokens']} tokens) and {self.stats['boilerplate_lines']} boilerplate lines "
+                f"({self.stats['boilerplate_tokens']} tokens)")
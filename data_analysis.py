@@ -1,20 +1,26 @@
 import streamlit as st
-from lida import Manager, TextGenerationConfig, llm
-from lida.datamodel import Goal
 import os
-import pandas as pd
-from langchain.callbacks import LLMonitorCallbackHandler
-from PIL import Image
-from io import BytesIO
 import base64
+import json
 from streamlit_feedback import streamlit_feedback
+from tracing import span, record_span, show_trace_sidebar
+from settings import get_setting
+from warmup import warm_up
 
-def base64_to_image(base64_string):
-    # Decode the base64 string
-    byte_data = base64.b64decode(base64_string)
-    
-    # Use BytesIO to convert the byte data to image
-    return Image.open(BytesIO(byte_data))
+# lida (and the model stack it pulls in), pandas and pyarrow are imported where a dataset is first
+# converted or profiled; until then they load in the background after the sidebar is drawn
+WARMUP_MODULES = ["pandas", "lida", "lida_cache", "dataset_store", "langchain.callbacks"]
+
+def raster_bytes(chart):
+    # st.image takes the PNG bytes directly, no need to decode them into a PIL image
+    return base64.b64decode(chart.raster) if chart.raster else None
+
+# the OpenAI text generator is reused across reruns; the Manager itself holds the
+# session's dataframe, so it is still created per run
+@st.cache_resource(show_spinner=False)
+def get_text_gen(api_key):
+    from lida import llm
+    return llm("openai", api_key=api_key)
 
 # make data dir if it doesn't exist
 os.makedirs("data", exist_ok=True)
@@ -33,6 +39,8 @@ openai_key = os.getenv("OPENAI_API_KEY")
 selected_model = "gpt-3.5-turbo"
 temperature = 0.2
 use_cache = True
+# DATA_INGEST=columnar converts uploads to Arrow and profiles a sample; csv keeps the old full read
+columnar_ingest = get_setting("DATA_INGEST", "columnar") == "columnar"
 
 #st.sidebar.write("### Choose a dataset")
 selected_dataset = None
@@ -62,15 +70,27 @@ if upload_own_data:
         # Get the original file name and extension
         file_name, file_extension = os.path.splitext(uploaded_file.name)
 
-        # Load the data depending on the file type
-        if file_extension.lower() == ".csv":
-            data = pd.read_csv(uploaded_file)
-        elif file_extension.lower() == ".json":
-            data = pd.read_json(uploaded_file)
-
-        # Save the data using the original file name in the data dir
-        uploaded_file_path = os.path.join("data", uploaded_file.name)
-        data.to_csv(uploaded_file_path, index=False)
+        if columnar_ingest:
+            # converted once to a memory-mapped Arrow file, reused by later reruns
+            converted = st.session_state.setdefault("converted_uploads", {})
+            uploaded_file_path = converted.get(uploaded_file.file_id)
+            if uploaded_file_path is None or not os.path.exists(uploaded_file_path):
+                from dataset_store import convert_upload
+                with span("data_analysis.ingest", bytes=uploaded_file.size) as trace:
+                    st.session_state.last_trace = trace
+                    uploaded_file_path = convert_upload(uploaded_file, "data")
+                converted[uploaded_file.file_id] = uploaded_file_path
+        else:
+            # Load the data depending on the file type
+            import pandas as pd
+            if file_extension.lower() == ".csv":
+                data = pd.read_csv(uploaded_file)
+            elif file_extension.lower() == ".json":
+                data = pd.read_json(uploaded_file)
+
+            # Save the data using the original file name in the data dir
+            uploaded_file_path = os.path.join("data", uploaded_file.name)
+            data.to_csv(uploaded_file_path, index=False)
 
         selected_dataset = uploaded_file_path
 
@@ -97,25 +117,40 @@ st.sidebar.write("Documentation: coming soon...")
 st.sidebar.write("Demo: https://youtu.be/FYkxdvGPo0k")
 st.sidebar.write("Thank you for testing!")
 st.sidebar.write("Questions/Feedback? Reach out to Ronak")
+warm_up(WARMUP_MODULES)
 
 if secret_password != st.secrets.APP_PASSWORD:
     st.warning("Password missing or incorrect")
 # Step 3 - Generate data summary
 if openai_key and selected_dataset and selected_method and secret_password == st.secrets.APP_PASSWORD:
+    import pandas as pd
+    from lida import Manager, TextGenerationConfig
+    from lida.utils import read_dataframe
+    from langchain.callbacks import LLMonitorCallbackHandler
+    from lida_cache import get_lida_cache, cached_summarize, cached_goals, cached_visualize, iter_visualize_all
+    from dataset_store import load_sample, summarize_columnar
     handler = LLMonitorCallbackHandler()
-    lida = Manager(text_gen=llm("openai", api_key=openai_key))
+    lida = Manager(text_gen=get_text_gen(openai_key))
+    lida_cache = get_lida_cache()
+    is_columnar = selected_dataset.endswith(".feather")
     textgen_config = TextGenerationConfig(
         n=1,
         temperature=temperature,
         model=selected_model,
         use_cache=use_cache)
             
+    with span("data_analysis.profile", dataset=str(selected_dataset)) as trace:
+        st.session_state.last_trace = trace
+        # **** lida.summarize *****
+        with span("lida.summarize") as summarize_span:
+            summary = cached_summarize(lida_cache, lida, selected_dataset, selected_method, textgen_config,
+                                       summarize_fn=summarize_columnar if is_columnar else None)
+            summarize_span.set(bytes=len(json.dumps(summary, default=str)))
+        with span("lida.goals", n=4) as goals_span:
+            goals = cached_goals(lida_cache, lida, selected_dataset, summary, 4, textgen_config)
+            goals_span.set(goals=len(goals))
+
     st.write("#### Summary")
-    # **** lida.summarize *****
-    summary = lida.summarize(
-        selected_dataset,
-        summary_method=selected_method,
-        textgen_config=textgen_config)
 
     if "dataset_description" in summary:
         st.write(summary["dataset_description"])
@@ -139,8 +174,6 @@ if openai_key and selected_dataset and selected_method and secret_password == st
     else:
         st.write(str(summary))
 
-    goals = lida.goals(summary, n=4, textgen_config=textgen_config)
-
     st.write ("#### Suggested Questions") 
     goal_questions = [goal.visualization for goal in goals]
     st.write(goal_questions)
@@ -158,11 +191,39 @@ if openai_key and selected_dataset and selected_method and secret_password == st
             st.info("Your Query: " + text_area)
           
             user_query = text_area
-            charts = lida.visualize(summary=summary, goal=user_query, textgen_config=textgen_config)  
+            with span("lida.visualize", query_chars=len(user_query)) as trace:
+                st.session_state.last_trace = trace
+                charts = cached_visualize(lida_cache, lida, selected_dataset, summary, user_query, textgen_config,
+                                          load_data=load_sample if is_columnar else read_dataframe)
+                trace.set(charts=len(charts), code_bytes=sum(len(chart.code or "") for chart in charts),
+                          raster_bytes=sum(len(chart.raster or "") for chart in charts))
             with st.expander("See Code"):
                 st.code(charts[0].code)
-            image_base64 = charts[0].raster
-            img = base64_to_image(image_base64)
-            st.image(img)
+            st.image(raster_bytes(charts[0]))
         streamlit_feedback(feedback_type="thumbs",optional_text_label="[Optional] Please provide an explanation",align="flex-start")
         st.download_button("Export Graph", data='''dummy image''', use_container_width=True)
+
+    # renders the suggested questions (and the query above, if any) side by side, each chart
+    # appearing as soon as its worker finishes
+    if st.button("Generate Graphs for All Questions"):
+        all_goals = goals + ([text_area] if text_area else [])
+        columns = st.columns(2)
+        slots = [columns[i % 2].empty() for i in range(len(all_goals))]
+        with span("lida.visualize_all", goals=len(all_goals)) as trace:
+            st.session_state.last_trace = trace
+            for position, goal, charts, seconds in iter_visualize_all(
+                    lida_cache, lida, selected_dataset, summary, all_goals, textgen_config,
+                    load_data=load_sample if is_columnar else read_dataframe,
+                    max_workers=get_setting("CHART_WORKERS", 4, int)):
+                record_span("lida.chart", seconds, parent=trace, goal=position, charts=len(charts))
+                with slots[position].container():
+                    st.write(f"**{goal.question}**")
+                    if charts and charts[0].raster:
+                        st.image(raster_bytes(charts[0]))
+                        with st.expander("See Code"):
+                            st.code(charts[0].code)
+                    else:
+                        st.warning("Could not generate a chart for this question")
+
+# debug panel goes last so it shows this run's LIDA calls
+show_trace_sidebar(st.session_state.get('last_trace'))
@@ -0,0 +1,159 @@
+import os
+import re
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+from pyarrow import json as pa_json
+from lida.utils import clean_column_name
+from lida_cache import register_fingerprint
+
+# Columnar ingestion for uploaded datasets. An upload is converted once to an uncompressed Arrow IPC
+# (.feather) file named after its content hash, so reruns reopen it instead of re-parsing the CSV.
+# The file is memory-mapped: column statistics are computed batch by batch in one streaming pass
+# and LIDA gets a random sample of SAMPLE_ROWS rows plus those exact statistics.
+
+SAMPLE_ROWS = 4500
+DISTINCT_LIMIT = 100000
+CSV_BLOCK_SIZE = 64 << 20
+# part of the converted file's name and fingerprint, so files converted by an older version are redone
+CONVERSION_VERSION = 2
+
+
+def upload_digest(uploaded_file):
+    # UploadedFile is an in-memory buffer, hashing its view avoids a copy
+    return hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+
+
+def converted_path(data_dir, file_name, digest):
+    stem = re.sub(r"[^0-9a-zA-Z_-]", "_", os.path.splitext(file_name)[0])
+    return os.path.join(data_dir, f"{stem}-{digest[:16]}-v{CONVERSION_VERSION}.feather")
+
+
+def clean_schema(schema):
+    return pa.schema([field.with_name(clean_column_name(field.name)) for field in schema])
+
+
+def iter_upload_batches(uploaded_file, file_extension):
+    uploaded_file.seek(0)
+    if file_extension == ".csv":
+        try:
+            # blank cells are nulls in every column, as in pd.read_csv
+            reader = pa_csv.open_csv(uploaded_file, read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+                                     convert_options=pa_csv.ConvertOptions(strings_can_be_null=True))
+            first = reader.read_next_batch()
+        except StopIteration:
+            return
+        yield first
+        yield from reader
+        return
+    try:
+        # newline-delimited JSON parses block by block; a JSON array needs the pandas reader
+        table = pa_json.read_json(uploaded_file)
+    except pa.ArrowInvalid:
+        uploaded_file.seek(0)
+        table = pa.Table.from_pandas(pd.read_json(uploaded_file), preserve_index=False)
+    yield from table.to_batches()
+
+
+def write_batches(path, batches):
+    tmp_path = path + ".tmp"
+    writer = None
+    try:
+        for batch in batches:
+            batch = pa.RecordBatch.from_arrays(batch.columns, schema=clean_schema(batch.schema))
+            if writer is None:
+                writer = pa.ipc.new_file(tmp_path, batch.schema)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("The uploaded file has no rows")
+    os.replace(tmp_path, path)
+
+
+def convert_upload(uploaded_file, data_dir="data"):
+    file_name, file_extension = os.path.splitext(uploaded_file.name)
+    digest = upload_digest(uploaded_file)
+    path = converted_path(data_dir, file_name, digest)
+    if not os.path.exists(path):
+        print(f"converting {uploaded_file.name} to {path}")
+        try:
+            write_batches(path, iter_upload_batches(uploaded_file, file_extension.lower()))
+        except pa.ArrowInvalid as error:
+            # types are inferred from the first CSV block; a column that changes type further
+            # down falls back to a full pandas parse
+            print(f"streaming conversion failed ({error}), reading with pandas")
+            uploaded_file.seek(0)
+            table = pa.Table.from_pandas(pd.read_csv(uploaded_file), preserve_index=False)
+            write_batches(path, table.to_batches())
+    # the upload's hash identifies the data, so the LIDA cache doesn't re-hash the converted file
+    register_fingerprint(path, f"sha256:{digest}:v{CONVERSION_VERSION}")
+    return path
+
+
+def open_table(path):
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def is_numeric(data_type):
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+
+
+def column_stats(path):
+    table = open_table(path)
+    stats = {}
+    for name, column in zip(table.column_names, table.columns):
+        count, minimum, maximum = 0, None, None
+        distinct, distinct_exact = None, True
+        for chunk in column.chunks:
+            count += len(chunk) - chunk.null_count
+            if is_numeric(chunk.type) or pa.types.is_temporal(chunk.type):
+                bounds = pc.min_max(chunk).as_py()
+                if bounds["min"] is not None:
+                    minimum = bounds["min"] if minimum is None else min(minimum, bounds["min"])
+                    maximum = bounds["max"] if maximum is None else max(maximum, bounds["max"])
+            if distinct_exact:
+                values = pc.unique(chunk.drop_null())
+                distinct = values if distinct is None else pc.unique(pa.concat_arrays([distinct, values]))
+                distinct_exact = len(distinct) <= DISTINCT_LIMIT
+        column_info = {"count": count, "null_count": len(column) - count,
+                       "num_unique_values": len(distinct or []) if distinct_exact else f">{DISTINCT_LIMIT}"}
+        if minimum is not None:
+            column_info["min"], column_info["max"] = minimum, maximum
+        if is_numeric(column.type) and count > 1:
+            # Arrow merges per-chunk moments pairwise, which stays exact for large values like epoch seconds
+            column_info["std"] = round(pc.stddev(column, ddof=1).as_py(), 6)
+        stats[name] = column_info
+    return len(table), stats
+
+
+def load_sample(path, n=SAMPLE_ROWS, seed=0):
+    table = open_table(path)
+    if len(table) > n:
+        rows = np.sort(np.random.default_rng(seed).choice(len(table), n, replace=False))
+        table = table.take(pa.array(rows))
+    return table.to_pandas()
+
+
+# Summarize a converted file: LIDA profiles the sample, then the sample-based
+# min/max/std/unique counts are replaced by the exact values from the streaming pass
+def summarize_columnar(lida, path, summary_method, textgen_config):
+    summary = lida.summarize(load_sample(path), file_name=os.path.basename(path),
+                             summary_method=summary_method, textgen_config=textgen_config)
+    row_count, stats = column_stats(path)
+    summary["num_rows"] = row_count
+    for field in summary.get("fields", []):
+        exact = stats.get(field["column"])
+        if exact is None:
+            continue
+        properties = field["properties"]
+        properties["num_unique_values"] = exact["num_unique_values"]
+        properties["null_count"] = exact["null_count"]
+        for key in ("min", "max", "std"):
+            if key in exact and key in properties:
+                properties[key] = exact[key]
+    return summary
@@ -5,30 +5,96 @@
 # Command to launch >> streamlit run app.py
 
 import streamlit as st
-from streamlit_chat import message
+#from streamlit_chat import message
 from dotenv import load_dotenv
 import os 
-from langchain.document_loaders import DirectoryLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Pinecone  
-from pinecone import Pinecone as pinecone_Pinecone
-from pinecone import ServerlessSpec
+from itertools import groupby
+from ingestion import iter_chunks, iter_batches, assign_chunk_ids, list_pdf_files, doc_id_for, file_sha256, parse_chunk_id
+from embedding_engine import EmbeddingScheduler, get_token_counter
+from chunking import ChunkCleaner, make_token_splitter
+from embedding_cache import get_embedding_cache, cached_embed_fn
+from resources import get_backend, get_embeddings, invalidate_agents
+from sparse_index import BM25Index
+from tracing import span, current_span, show_trace_sidebar
+from ingest_jobs import submit_job, ensure_workers, list_jobs, has_active_job
+from settings import get_setting
+from warmup import warm_up
+
+# langchain's PDF loader and splitters are imported where they are used; the pipeline's heavy
+# modules are loaded in the background once the page is shown
+WARMUP_MODULES = ["langchain.document_loaders", "langchain.text_splitter", "langchain.embeddings.openai",
+                  "vector_store", "faiss_store", "faiss"]
 
 #### PREPARATION #### 
 def create_vector_index_from_pdf(uploaded_files,password):
     print("get_vector_index_from_pdf called")
-    if password != st.secrets.APP_PASSWORD: 
+    if password != get_setting("APP_PASSWORD"): 
         st.warning("Incorrect Password")
         return
     if check_index() != "Valid":
         st.warning("Agent Name Not Valid")
         return
-    data_folder = save_files(uploaded_files)
-    text_chunks = get_chunks(data_folder)
-    vector_db = get_vector_db(text_chunks)
+    with span("agent.create", agent=st.session_state.new_index) as trace:
+        st.session_state.last_trace = trace
+        data_folder = save_files(uploaded_files)
+        text_chunks = get_chunks(data_folder)
+        vector_db = get_vector_db(text_chunks, st.session_state.new_index)
+    return vector_db
+
+def update_vector_index_from_pdf(uploaded_files,password):
+    print("update_vector_index_from_pdf called")
+    if password != get_setting("APP_PASSWORD"): 
+        st.warning("Incorrect Password")
+        return
+    if check_index(mode="update") != "Valid":
+        st.warning("Agent Name Not Valid")
+        return
+    with span("agent.update", agent=st.session_state.new_index) as trace:
+        st.session_state.last_trace = trace
+        data_folder = save_files(uploaded_files)
+        vector_db = update_vector_db(data_folder, st.session_state.new_index)
     return vector_db
 
+def queue_ingestion_job(kind, uploaded_files, password):
+    print("queue_ingestion_job called")
+    if password != get_setting("APP_PASSWORD"): 
+        st.warning("Incorrect Password")
+        return
+    if not uploaded_files:
+        st.warning("Please upload at least one PDF")
+        return
+    if check_index(mode=kind) != "Valid":
+        st.warning("Agent Name Not Valid")
+        return
+    if has_active_job(st.session_state.new_index):
+        st.warning("This agent already has a job in progress")
+        return
+    job_id = submit_job(kind, st.session_state.new_index, uploaded_files)
+    ensure_workers(get_setting("INGEST_JOB_WORKERS", 2, int))
+    st.success(f"Job {job_id} queued. You can close this page, the agent is built in the background.")
+
+# polled every few seconds; jobs are read from the queue, so they show up in any session
+@st.fragment(run_every=get_setting("INGEST_JOB_POLL_SECONDS", 2, float))
+def show_jobs():
+    jobs = list_jobs(limit=5)
+    if not jobs:
+        return
+    st.write("#### Recent builds")
+    for job in jobs:
+        progress = job["progress"]
+        details = (f"{progress.get('files_parsed', 0)} of {progress.get('files', 0)} files, "
+                   f"{progress.get('pages_parsed', 0)} pages parsed, {progress.get('chunks_embedded', 0)} chunks embedded")
+        if progress.get("chunks_skipped"):
+            details += f", {progress['chunks_skipped']} resumed from checkpoint"
+        label = f"**{job['index_name']}** ({job['kind']}, attempt {job['attempts']}): {job['status']}"
+        if job["status"] in ("queued", "running"):
+            st.progress(min(1.0, progress.get("files_parsed", 0) / max(1, progress.get("files", 0))),
+                        text=f"{label} - {details}")
+        else:
+            st.write(f"{label} - {details}")
+        if job["error"]:
+            st.caption(f":red[{job['error']}]")
+
 def save_files(uploaded_files):
     # delete old files
     for filename in os.listdir("data"):
@@ -41,32 +107,220 @@ def save_files(uploaded_files):
         st.success("Saved File to Data: "+file.name)
     return("data")
 
-def get_chunks(data_folder):
+def get_chunks(data_folder, pdf_files=None, progress=None):
     print("get chunks called")
+    cleaner, text_splitter = get_chunker()
+
+    def clean_pages(pages):
+        if progress is not None:
+            progress.add(files_parsed=1, pages_parsed=len(pages))
+        return cleaner.clean_pages(pages)
+
+    if get_setting("INGEST_PARALLEL", True, bool) or pdf_files is not None:
+        # generator: chunks flow into get_vector_db while later PDFs are still being parsed
+        text_chunks = iter_chunks(os.path.join(os.getcwd(),data_folder),
+                                  max_workers=get_setting("INGEST_WORKERS", None, int),
+                                  max_in_flight=get_setting("INGEST_MAX_IN_FLIGHT", None, int),
+                                  pdf_files=pdf_files, text_splitter=text_splitter,
+                                  page_filter=clean_pages)
+        return dedup_chunks(text_chunks, cleaner)
+    from langchain.document_loaders import DirectoryLoader, PyPDFLoader
     loader = DirectoryLoader(os.path.join(os.getcwd(),data_folder), loader_cls = PyPDFLoader)
-    pages = loader.load_and_split()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    text_chunks = text_splitter.split_documents(pages)
-    return text_chunks
+    pages = []
+    for source, file_pages in groupby(loader.load(), key=lambda page: page.metadata["source"]):
+        pages.extend(clean_pages(list(file_pages)))
+    text_chunks = assign_chunk_ids(text_splitter.split_documents(pages))
+    return dedup_chunks(text_chunks, cleaner)
+
+def get_chunker():
+    # CHUNKER=token splits by embedding-model tokens and strips boilerplate; chars keeps the 500-character splitter
+    count_tokens = get_token_counter()
+    if get_setting("CHUNKER", "token") == "chars":
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+        strip_boilerplate = False
+    else:
+        text_splitter = make_token_splitter(count_tokens,
+                                            chunk_tokens=get_setting("CHUNK_TOKENS", 128, int),
+                                            overlap_tokens=get_setting("CHUNK_OVERLAP_TOKENS", 16, int))
+        strip_boilerplate = get_setting("STRIP_BOILERPLATE", True, bool)
+    cleaner = ChunkCleaner(count_tokens, strip_boilerplate=strip_boilerplate,
+                           dedup=get_setting("DEDUP_CHUNKS", True, bool),
+                           max_distance=get_setting("DEDUP_MAX_DISTANCE", 3, int))
+    return cleaner, text_splitter
+
+def dedup_chunks(text_chunks, cleaner):
+    # duplicates are dropped before they reach the embedding backend; the report is shown
+    # once the last chunk has been consumed
+    yield from cleaner.filter(text_chunks)
+    active = current_span()
+    if active is not None:
+        active.set(**{f"chunker.{key}": value for key, value in cleaner.stats.items()})
+    print(cleaner.summary())
+    st.info(cleaner.summary())
 
-def get_vector_db(text_chunks):
+def get_vector_db(text_chunks, new_index, progress=None):
     print("get vector db called")
-    embeddings = OpenAIEmbeddings()
-    pc = pinecone_Pinecone(api_key=st.secrets["PINECONE_API_KEY"])
-    new_index = st.session_state.new_index
-    pc.create_index(name=new_index, metric="cosine", dimension=1536,
-                    spec=ServerlessSpec(cloud='aws', region='us-west-2') 
-                    )
-    pinecone_db = Pinecone.from_documents(text_chunks, embeddings, index_name=new_index)
-    return pinecone_db
-
-def check_index():
-    pc = pinecone_Pinecone(api_key=st.secrets["PINECONE_API_KEY"])
+    embeddings = get_embeddings()
+    backend = get_backend()
+    # only an index this job created is resumed; one that already existed under the name belongs to another agent
+    resume = (progress is not None and progress.resume and progress.values.get("index_created")
+              and new_index in backend.list_indexes())
+    if not resume:
+        backend.create_index(new_index, dimension=1536)
+        if progress is not None:
+            progress.set(index_created=True)
+    index = backend.open_index(new_index)
+    # a resumed job keeps the chunks saved at its last checkpoint; chunks upserted after it (live on
+    # Pinecone) are upserted again so they also reach the BM25 index
+    sparse_index = (BM25Index.load(backend.local_path(new_index)) if resume else None) or BM25Index()
+    done_ids = set(sparse_index.ids)
+    upsert_chunks(index, text_chunks, embeddings, sparse_index, progress=progress, skip_ids=done_ids,
+                  checkpoint=lambda: save_checkpoint(backend, new_index, index, sparse_index))
+    with span("save_index"):
+        backend.save_index(index)
+        sparse_index.save(backend.local_path(new_index))
+        backend.bump_index_version(new_index)
+    invalidate_agents()
+    vector_db = backend.get_vector_db(new_index, embeddings)
+    return vector_db
+
+def update_vector_db(data_folder, index_name, progress=None):
+    print("update vector db called")
+    embeddings = get_embeddings()
+    backend = get_backend()
+    index = backend.open_index(index_name)
+    indexed_files = get_indexed_files(index)
+    if indexed_files is None:
+        st.warning("This agent was built before incremental updates were available. Please create it again under a new name.")
+        return
+    uploaded_files = {}
+    for path in list_pdf_files(os.path.join(os.getcwd(),data_folder)):
+        uploaded_files[doc_id_for(path)] = (file_sha256(path), path)
+    # a file needs (re)ingesting when its name is new or its content hash changed
+    changed_files = [path for doc_id, (file_hash, path) in uploaded_files.items()
+                     if file_hash not in indexed_files.get(doc_id, {})]
+    sparse_index = BM25Index.load(backend.local_path(index_name)) or BM25Index()
+    done_ids = set()
+    if progress is not None:
+        if progress.resume and "changed_files" in progress.values:
+            # files upserted before the interruption now look unchanged, so use the first run's list;
+            # only chunks in the last checkpoint's BM25 index count as done (see get_vector_db)
+            changed_files = [path for _, path in uploaded_files.values()
+                             if os.path.basename(path) in progress.values["changed_files"]]
+            done_ids = set(sparse_index.ids)
+        else:
+            progress.set(changed_files=[os.path.basename(path) for path in changed_files])
+    stale_ids = []
+    for doc_id, hashes in indexed_files.items():
+        for file_hash, ids in hashes.items():
+            if doc_id not in uploaded_files or uploaded_files[doc_id][0] != file_hash:
+                stale_ids.extend(ids)
+    st.info(f"{len(changed_files)} new or changed file(s), {len(uploaded_files) - len(changed_files)} unchanged, "
+            f"{len(stale_ids)} outdated chunk(s) to remove")
+    if changed_files:
+        upsert_chunks(index, get_chunks(data_folder, pdf_files=changed_files, progress=progress), embeddings,
+                      sparse_index, progress=progress, skip_ids=done_ids,
+                      checkpoint=lambda: save_checkpoint(backend, index_name, index, sparse_index))
+    # delete after upserting so questions keep getting answers while the agent is updated
+    for batch in iter_batches(stale_ids, 1000):
+        index.delete(ids=batch)
+    sparse_index.delete(stale_ids)
+    with span("save_index"):
+        backend.save_index(index)
+        sparse_index.save(backend.local_path(index_name))
+        backend.bump_index_version(index_name)
+    invalidate_agents()
+    vector_db = backend.get_vector_db(index_name, embeddings)
+    return vector_db
+
+def get_indexed_files(index):
+    # doc_id -> {file_hash: [vector ids]}; None if the index holds ids from before incremental updates
+    indexed_files = {}
+    for ids in index.list():
+        for vector_id in ids:
+            parsed = parse_chunk_id(vector_id)
+            if parsed is None:
+                return None
+            doc_id, file_hash = parsed
+            indexed_files.setdefault(doc_id, {}).setdefault(file_hash, []).append(vector_id)
+    return indexed_files
+
+def save_checkpoint(backend, index_name, index, sparse_index):
+    with span("save_index", checkpoint=True):
+        backend.checkpoint_index(index)
+        sparse_index.save(backend.local_path(index_name))
+        backend.bump_index_version(index_name)
+
+# progress, skip_ids and checkpoint are used by background jobs: chunks in skip_ids were upserted
+# before an interruption, and checkpoint() persists the upserts every INGEST_CHECKPOINT_BATCHES batches
+def upsert_chunks(index, text_chunks, embeddings, sparse_index=None, progress=None, skip_ids=None, checkpoint=None):
+    cache = get_embedding_cache(get_setting("EMBED_CACHE_DIR", ".cache/embeddings"), embeddings.model,
+                                max_entries=get_setting("EMBED_CACHE_MAX_ENTRIES", 200000, int))
+    hits, misses = cache.hits, cache.misses
+    scheduler = EmbeddingScheduler(cached_embed_fn(cache, embeddings.embed_documents),
+                                   batch_size=get_setting("EMBED_BATCH_SIZE", 64, int),
+                                   max_concurrency=get_setting("EMBED_CONCURRENCY", 4, int),
+                                   count_tokens=get_token_counter())
+    if skip_ids:
+        text_chunks = skip_done_chunks(text_chunks, skip_ids, progress)
+    checkpoint_every = get_setting("INGEST_CHECKPOINT_BATCHES", 20, int)
+    # text_chunks may be a generator, so upsert each batch as soon as it is embedded
+    for batch_number, (batch, vectors) in enumerate(scheduler.iter_embed(text_chunks), start=1):
+        records = to_pinecone_vectors(batch, vectors)
+        with span("upsert", vectors=len(records), bytes=sum(4 * len(vector) + len(doc.page_content)
+                                                           for vector, doc in zip(vectors, batch))):
+            index.upsert(vectors=records)
+        if sparse_index is not None:
+            # BM25 inverted index for hybrid retrieval, persisted next to the vectors
+            sparse_index.add((record["id"], doc.page_content, dict(doc.metadata))
+                             for record, doc in zip(records, batch))
+        if progress is not None:
+            progress.add(chunks_embedded=len(batch))
+        if checkpoint is not None and batch_number % checkpoint_every == 0:
+            checkpoint()
+            if progress is not None:
+                progress.set(checkpoint_batch=batch_number)
+    cache.save()
+    hits, misses = cache.hits - hits, cache.misses - misses
+    cache_text = f"Embedding cache hit rate: {hits / max(1, hits + misses):.0%} ({hits} of {hits + misses} chunks reused)"
+    print(scheduler.stats.summary())
+    print(cache_text)
+    st.info(scheduler.stats.summary() + "  \n" + cache_text)
+
+def skip_done_chunks(text_chunks, skip_ids, progress=None):
+    for chunk in text_chunks:
+        if chunk.metadata["chunk_id"] in skip_ids:
+            if progress is not None:
+                progress.add(chunks_skipped=1)
+            continue
+        yield chunk
+
+def to_pinecone_vectors(text_chunks, vectors):
+    # same layout as langchain's Pinecone.add_texts: chunk text is stored under the "text" metadata key
+    # (the FAISS backend reads it back from there too)
+    records = []
+    for doc, vector in zip(text_chunks, vectors):
+        metadata = dict(doc.metadata)
+        metadata["text"] = doc.page_content
+        records.append({"id": metadata.pop("chunk_id"), "values": vector, "metadata": metadata})
+    return records
+
+def check_index(mode="create"):
+    # read from the backend rather than the cached agent list: agents created by background jobs
+    # in other processes wouldn't show up there for up to INDEX_LIST_CACHE_TTL seconds
+    existing_indexes = get_backend().list_indexes()
     index_name = st.session_state.new_index
     if index_name == "":
         st.warning('Agent name cannot be blank', icon="⚠️")
         return "Invalid"
-    elif index_name in pc.list_indexes():
+    elif mode == "update":
+        if index_name not in existing_indexes:
+            st.warning('Agent does not exist', icon="⚠️")
+            return "Invalid"
+        st.success('Agent found :white_check_mark:')
+        return "Valid"
+    elif index_name in existing_indexes:
         st.warning('Agent already exists', icon="⚠️")
         return "Invalid"
     else: 
@@ -83,6 +337,7 @@ def main():
     
     col1, col2 = st.columns(2)
     col1.text_input("Agent Name", label_visibility='visible', placeholder="Enter name for New Agent", key='new_index')
+    mode = col2.radio("Mode", ["Create new agent", "Update existing agent"], key='mode')
     #col2.button("Check Availability", on_click= check_index)
     
     #st.text_input("Agent Description", placeholder="Enter a short description of your agent")
@@ -113,11 +368,28 @@ def main():
     st.write('')
     st.checkbox("I have read the Walmart  GenAI Security & Legal Policies. <placeholder for URL to Legal policies>")
 
-    if st.button("Create"):
-        with st.spinner("Processing"):
-            pinecone_index = create_vector_index_from_pdf(uploaded_files,st.session_state.password)
-            st.success("Agent created successfully !!")
+    # INGEST_JOBS=true runs builds in background worker processes; false builds inside this session
+    use_jobs = get_setting("INGEST_JOBS", True, bool)
+    if mode == "Update existing agent":
+        if st.button("Update"):
+            if use_jobs:
+                queue_ingestion_job("update", uploaded_files, st.session_state.password)
+            else:
+                with st.spinner("Processing"):
+                    pinecone_index = update_vector_index_from_pdf(uploaded_files,st.session_state.password)
+                    if pinecone_index is not None:
+                        st.success("Agent updated successfully !!")
+    elif st.button("Create"):
+        if use_jobs:
+            queue_ingestion_job("create", uploaded_files, st.session_state.password)
+        else:
+            with st.spinner("Processing"):
+                pinecone_index = create_vector_index_from_pdf(uploaded_files,st.session_state.password)
+                st.success("Agent created successfully !!")
+    if use_jobs:
+        show_jobs()
     
+    show_trace_sidebar(st.session_state.get('last_trace'))
     st.sidebar.write("\n\n\n\n")
     st.sidebar.write("### Caution")
     st.sidebar.write("Experimental prototype may have bugs")
@@ -126,6 +398,7 @@ def main():
     st.sidebar.write("Demo: https://youtu.be/FYkxdvGPo0k")
     st.sidebar.write("Thank you for testing!")
     st.sidebar.write("Questions/Feedback? Reach out to Ronak")
+    warm_up(WARMUP_MODULES)
 
 
 
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+VECTORS_FILE = "vectors.f32"
+DB_FILE = "index.sqlite3"
+LEGACY_INDEX_FILE = "index.json"
+MIN_CAPACITY = 1024
+QUERY_BATCH = 500
+
+
+def cache_key(text, model):
+    return hashlib.sha256((model + "\0" + text).encode("utf-8")).hexdigest()
+
+
+# Content-addressed embedding cache on disk, shared by the app and the background ingestion workers.
+# Vectors live in a memory-mapped float32 matrix (one row per slot) and index.sqlite3 maps
+# sha256(model, text) -> slot with its last use. When max_entries is reached the least recently used
+# entry is evicted and its slot reused, so the files never outgrow the bound.
+# Every lookup and insert runs inside one IMMEDIATE transaction: processes take turns reading the
+# map, allocating slots and writing rows, so two of them never hand out the same slot and a slot is
+# never overwritten while another process reads it.
+class EmbeddingCache:
+    def __init__(self, cache_dir, model, max_entries=200000):
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha256(model.encode("utf-8")).hexdigest()[:16])
+        self.model = model
+        self.max_entries = max_entries
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.cache_dir, VECTORS_FILE)
+        # rollback journal (not WAL): the transaction lock then also covers the memmap rows
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, DB_FILE), timeout=60,
+                                  isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER UNIQUE, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY)")
+        with self._transaction():
+            self._migrate_legacy_index()
+            while self._meta("count", 0) > self.max_entries:
+                self._evict()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self._map_vectors()
+                yield
+                if self.vectors is not None:
+                    self.vectors.flush()
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _meta(self, name, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def _map_vectors(self):
+        # another process may have grown the file since this one mapped it
+        dimension, capacity = self._meta("dimension"), self._meta("capacity", 0)
+        if dimension is None or (self.vectors is not None and self.vectors.shape[0] == capacity):
+            return
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dimension))
+
+    def _migrate_legacy_index(self):
+        # caches written before the SQLite index kept the map in index.json (least recently used first)
+        index_path = os.path.join(self.cache_dir, LEGACY_INDEX_FILE)
+        if not os.path.exists(index_path) or self._meta("dimension") is not None:
+            return
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("model") == self.model and os.path.exists(self.vectors_path):
+            capacity = os.path.getsize(self.vectors_path) // (4 * index["dimension"])
+            entries = [(key, slot, used) for used, (key, slot) in enumerate(index["entries"]) if slot < capacity]
+            self.db.executemany("INSERT OR IGNORE INTO entries (key, slot, used) VALUES (?, ?, ?)", entries)
+            used_slots = {slot for _, slot, _ in entries}
+            next_slot = max(used_slots) + 1 if used_slots else 0
+            self.db.executemany("INSERT INTO free_slots (slot) VALUES (?)",
+                                [(slot,) for slot in range(next_slot) if slot not in used_slots])
+            for name, value in (("dimension", index["dimension"]), ("capacity", capacity),
+                                ("next_slot", next_slot), ("count", len(entries))):
+                self._set_meta(name, value)
+            self._map_vectors()
+        os.remove(index_path)
+
+    def _grow(self, dimension):
+        capacity = self._meta("capacity", 0)
+        new_capacity = min(self.max_entries, max(MIN_CAPACITY, 2 * capacity))
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * dimension * 4)
+        self._set_meta("capacity", new_capacity)
+        self._map_vectors()
+
+    def _evict(self):
+        key, slot = self.db.execute("SELECT key, slot FROM entries ORDER BY used LIMIT 1").fetchone()
+        self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.db.execute("INSERT INTO free_slots (slot) VALUES (?)", (slot,))
+        self._set_meta("count", self._meta("count", 0) - 1)
+
+    def _slot_for_new_entry(self, dimension):
+        row = self.db.execute("SELECT slot FROM free_slots LIMIT 1").fetchone()
+        if row is None:
+            next_slot = self._meta("next_slot", 0)
+            if next_slot >= self._meta("capacity", 0) and self._meta("capacity", 0) < self.max_entries:
+                self._grow(dimension)
+            if next_slot < self._meta("capacity", 0):
+                self._set_meta("next_slot", next_slot + 1)
+                return next_slot
+            self._evict()
+            row = self.db.execute("SELECT slot FROM free_slots LIMIT 1").fetchone()
+        self.db.execute("DELETE FROM free_slots WHERE slot = ?", (row[0],))
+        return row[0]
+
+    # returns {key: vector} for the keys that are cached and counts hits/misses
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self._transaction():
+            for start in range(0, len(keys), QUERY_BATCH):
+                batch = keys[start:start + QUERY_BATCH]
+                rows = self.db.execute(f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                                       batch).fetchall()
+                for key, slot in rows:
+                    found[key] = self.vectors[slot].tolist()
+            self.db.executemany("UPDATE entries SET used = ? WHERE key = ?", [(now, key) for key in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._transaction():
+            if self._meta("dimension") is None:
+                self._set_meta("dimension", len(next(iter(items.values()))))
+            dimension = self._meta("dimension")
+            for key, vector in items.items():
+                # another process may have cached the same text in the meantime
+                if self.db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key)).rowcount:
+                    continue
+                slot = self._slot_for_new_entry(dimension)
+                self.vectors[slot] = vector
+                self.db.execute("INSERT INTO entries (key, slot, used) VALUES (?, ?, ?)", (key, slot, now))
+                self._set_meta("count", self._meta("count", 0) + 1)
+
+    def save(self):
+        # every put_many is committed as it happens; kept for callers that save at the end of a build
+        with self._lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+
+
+# Wrap an embed function so only texts not seen before reach the embedding backend
+def cached_embed_fn(cache, embed_fn):
+    def embed(texts):
+        keys = [cache_key(text, cache.model) for text in texts]
+        found = cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            new_vectors = embed_fn([texts[i] for i in missing])
+            cache.put_many({keys[i]: vector for i, vector in zip(missing, new_vectors)})
+            for i, vector in zip(missing, new_vectors):
+                found[keys[i]] = vector
+        return [found[key] for key in keys]
+    return embed
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# one cache instance per (directory, model) per process, shared by all Streamlit sessions
+def get_embedding_cache(cache_dir, model, max_entries=200000):
+    with _caches_lock:
+        key = (os.path.abspath(cache_dir), model)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(cache_dir, model, max_entries=max_entries)
+        return _caches[key]
@@ -0,0 +1,192 @@
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import tiktoken
+from ingestion import iter_batches
+from tracing import current_span, record_span
+
+
+def get_token_counter(model="text-embedding-ada-002"):
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception as error:
+        # tiktoken downloads its encodings on first use, which fails on offline machines
+        print(f"tiktoken unavailable ({type(error).__name__}), estimating tokens as characters / 4")
+        return lambda text: max(1, len(text) // 4)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def get_status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limit_error(error):
+    return get_status_code(error) == 429 or "RateLimit" in type(error).__name__
+
+
+def is_retryable_error(error):
+    if is_rate_limit_error(error) or isinstance(error, TimeoutError):
+        return True
+    status = get_status_code(error)
+    if status is not None and status >= 500:
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "APIConnectionError" in name
+
+
+def get_retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Deterministic stand-in for the embedding backend, with artificial latency and optional 429s
+# (every rate_limit_every-th call, with a Retry-After header when retry_after is set)
+def make_fake_embed_fn(dimension=1536, latency=0.0, rate_limit_every=None, retry_after=None):
+    calls = {"count": 0}
+    lock = threading.Lock()
+
+    class FakeRateLimitError(Exception):
+        status_code = 429
+        response = SimpleNamespace(headers={} if retry_after is None else {"retry-after": str(retry_after)})
+
+    def embed_fn(texts):
+        with lock:
+            calls["count"] += 1
+            call_number = calls["count"]
+        if latency:
+            time.sleep(latency)
+        if rate_limit_every and call_number % rate_limit_every == 0:
+            raise FakeRateLimitError("fake rate limit")
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+            rng = random.Random(seed)
+            vector = [rng.uniform(-1.0, 1.0) for _ in range(dimension)]
+            norm = sum(x * x for x in vector) ** 0.5 or 1.0
+            vectors.append([x / norm for x in vector])
+        return vectors
+
+    return embed_fn
+
+
+class EmbeddingStats:
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.batches = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def chunks_per_sec(self):
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_sec(self):
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"Embedded {self.chunks} chunks ({self.tokens} tokens) in {self.batches} batches, "
+                f"{self.elapsed:.1f}s: {self.chunks_per_sec:.1f} chunks/sec, {self.tokens_per_sec:.0f} tokens/sec, "
+                f"{self.retries} retries ({self.rate_limited} rate limited)")
+
+
+# Sends chunks to embed_fn in batches with a bounded number of requests in flight.
+# A rate-limit error pauses every worker (honouring Retry-After) and retries with exponential backoff.
+class EmbeddingScheduler:
+    def __init__(self, embed_fn, batch_size=64, max_concurrency=4, max_retries=6,
+                 base_delay=1.0, max_delay=60.0, count_tokens=None):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.count_tokens = count_tokens
+        self.stats = EmbeddingStats()
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._trace_parent = None
+
+    def _wait_for_pause(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _backoff(self, error, attempt):
+        delay = get_retry_after(error) or min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay *= random.uniform(1.0, 1.25)
+        with self._lock:
+            self.stats.retries += 1
+            if is_rate_limit_error(error):
+                self.stats.rate_limited += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        if not is_rate_limit_error(error):
+            time.sleep(delay)
+
+    def _embed_batch(self, texts):
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_pause()
+            try:
+                vectors = self.embed_fn(texts)
+                break
+            except Exception as error:
+                if attempt == self.max_retries or not is_retryable_error(error):
+                    raise
+                print(f"embedding batch failed ({type(error).__name__}), retry {attempt + 1}")
+                self._backoff(error, attempt)
+        tokens = sum(self.count_tokens(text) for text in texts) if self.count_tokens else 0
+        with self._lock:
+            self.stats.chunks += len(texts)
+            self.stats.tokens += tokens
+            self.stats.batches += 1
+        # worker threads don't inherit the caller's span, so the parent is passed explicitly
+        record_span("embed", time.perf_counter() - started, parent=self._trace_parent,
+                    chunks=len(texts), tokens=tokens, bytes=sum(len(text) for text in texts))
+        return vectors
+
+    # chunks: iterable of langchain Documents (may be a generator).
+    # Yields (documents, vectors) per batch, in input order.
+    def iter_embed(self, chunks):
+        self.stats.started = time.perf_counter()
+        self._trace_parent = current_span()
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            for batch in iter_batches(chunks, self.batch_size):
+                texts = [doc.page_content for doc in batch]
+                in_flight.append((batch, pool.submit(self._embed_batch, texts)))
+                if len(in_flight) >= 2 * self.max_concurrency:
+                    batch, future = in_flight.popleft()
+                    yield batch, future.result()
+            while in_flight:
+                batch, future = in_flight.popleft()
+                yield batch, future.result()
+        self.stats.finished = time.perf_counter()
+
+    def embed_texts(self, texts):
+        self.stats.started = time.perf_counter()
+        self._trace_parent = current_span()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            results = pool.map(self._embed_batch, iter_batches(texts, self.batch_size))
+            vectors = [vector for batch_vectors in results for vector in batch_vectors]
+        self.stats.finished = time.perf_counter()
+        return vectors
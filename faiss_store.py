@@ -0,0 +1,73 @@
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain.vectorstores.utils import DistanceStrategy
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+from vector_store import normalize, truncate_vectors, set_search_params
+
+# langchain VectorStore wrappers for local FAISS agents, kept apart from vector_store.py so the
+# apps can list and manage agents without importing langchain.
+
+# Searches the compressed or truncated index for a shortlist of rerank_factor * k candidates, then
+# orders them by exact cosine similarity against the full float32 rows of the memory-mapped
+# vectors.npy, so only the shortlisted rows are read from disk. Tombstoned rows of an HNSW agent
+# (see LocalFaissIndex) are excluded inside the graph search.
+class RerankingFAISS(FAISS):
+    def __init__(self, *args, full_vectors=None, truncate_dim=None, rerank_factor=4, excluded_rows=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.full_vectors = full_vectors
+        self.truncate_dim = truncate_dim
+        self.rerank_factor = rerank_factor
+        self.search_params = None
+        import faiss
+        if excluded_rows and isinstance(self.index, faiss.IndexHNSW):
+            self.search_params = faiss.SearchParametersHNSW()
+            self.search_params.efSearch = faiss.downcast_index(self.index).hnsw.efSearch
+            # the selectors are only referenced from C++, so keep them alive here
+            self.excluded = faiss.IDSelectorBatch(np.asarray(excluded_rows, dtype=np.int64))
+            self.selector = faiss.IDSelectorNot(self.excluded)
+            self.search_params.sel = self.selector
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        query = normalize([embedding])
+        shortlist = max(k if filter is None else fetch_k, k * self.rerank_factor)
+        _, indices = self.index.search(truncate_vectors(query, self.truncate_dim), shortlist, params=self.search_params)
+        rows = np.sort(indices[0][indices[0] != -1])
+        if not len(rows):
+            return []
+        scores = np.asarray(self.full_vectors[rows], dtype=np.float32) @ query[0]
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+        score_threshold = kwargs.get("score_threshold")
+        docs = []
+        for position in np.argsort(-scores, kind="stable"):
+            vector_id = self.index_to_docstore_id.get(int(rows[position]))
+            if vector_id is None:
+                # tombstoned row still held by the index
+                continue
+            doc = self.docstore.search(vector_id)
+            if filter_func is not None and not filter_func(doc.metadata):
+                continue
+            if score_threshold is not None and scores[position] < score_threshold:
+                continue
+            docs.append((doc, float(scores[position])))
+        return docs[:k]
+
+
+def make_faiss_store(embeddings, index, local_index, config=None):
+    # config defaults to the agent's own; the storage report passes variants of it
+    config = config or local_index.config
+    set_search_params(index, config)
+    docs = {}
+    for vector_id, metadata in zip(local_index.ids, local_index.metadatas):
+        if vector_id is None:
+            continue
+        metadata = dict(metadata)
+        docs[vector_id] = Document(page_content=metadata.pop("text", ""), metadata=metadata)
+    index_to_id = {row: vector_id for row, vector_id in enumerate(local_index.ids) if vector_id is not None}
+    args = (embeddings, index, InMemoryDocstore(docs), index_to_id)
+    tombstones = local_index.tombstones
+    if config.get("storage", "float32") == "float32" and not config.get("truncate_dim") and not tombstones:
+        return FAISS(*args, normalize_L2=True, distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT)
+    return RerankingFAISS(*args, normalize_L2=True, distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+                          full_vectors=local_index.load_vectors(), truncate_dim=config.get("truncate_dim"),
+                          rerank_factor=config.get("rerank_factor", 4), excluded_rows=tombstones)
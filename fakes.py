@@ -0,0 +1,73 @@
+import time
+import hashlib
+from functools import lru_cache
+import numpy as np
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+from sparse_index import tokenize
+from embedding_engine import get_token_counter
+
+# Local stand-ins for OpenAI, selected with LLM_BACKEND=fake and EMBEDDINGS_BACKEND=fake.
+
+
+@lru_cache(maxsize=100000)
+def _hashed_token(token, dimension):
+    digest = hashlib.md5(token.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") % dimension, 1.0 if digest[4] & 1 else -1.0
+
+
+@lru_cache(maxsize=1)
+def _chat_token_counter():
+    return get_token_counter("gpt-3.5-turbo")
+
+
+# Deterministic bag-of-words embeddings (feature hashing), so texts sharing words land close
+# together and retrieval results are meaningful without calling OpenAI
+class HashEmbeddings(Embeddings):
+    def __init__(self, dimension=1536, model="fake-hash-embeddings"):
+        self.dimension = dimension
+        self.model = model
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in tokenize(text):
+            position, sign = _hashed_token(token, self.dimension)
+            vector[position] += sign
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+# Replies with a canned answer, emitting it word by word every token_delay seconds
+# through the same on_llm_new_token callback ChatOpenAI uses when streaming
+class FakeStreamingChatModel(BaseChatModel):
+    response: str = "This is a canned answer from the local fake chat model."
+    token_delay: float = 0.02
+    first_token_delay: float = 0.2
+    streaming: bool = True
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming-chat"
+
+    def get_num_tokens(self, text):
+        # count like ChatOpenAI so token-budgeted memory behaves the same offline
+        return _chat_token_counter()(text)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_delay)
+        tokens = self.response.split(" ")
+        for i, token in enumerate(tokens):
+            if i:
+                token = " " + token
+                time.sleep(self.token_delay)
+            if run_manager and self.streaming:
+                run_manager.on_llm_new_token(token)
+        message = AIMessage(content=self.response)
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,186 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+from langchain.schema import BaseRetriever, Document
+from sparse_index import tokenize
+
+# Per-stage timings of the last retrieval made on this thread (Streamlit runs each
+# session's script on its own thread, while the retriever itself is shared)
+_stage_timings = threading.local()
+
+
+def pop_last_stage_timings():
+    timings = getattr(_stage_timings, "value", {})
+    _stage_timings.value = {}
+    return timings
+
+
+# Lightweight local reranker: scores each chunk by the share of the query's IDF weight it covers
+# (so a rare term like "ERR-404" counts for much more than "what" or "the") and blends that with the
+# chunk's normalised fusion score, so the fused order still decides between similar chunks
+class LexicalReranker:
+    def __init__(self, weight=0.5):
+        self.weight = weight
+
+    def rerank(self, query, docs, scores=None, idf=None):
+        idf = idf or (lambda term: 1.0)
+        weights = {term: idf(term) for term in set(tokenize(query))}
+        total = sum(weights.values())
+        if not docs or not total:
+            return docs
+        scores = scores or [1.0] * len(docs)
+        top_score = max(scores) or 1.0
+
+        def blended(pair):
+            doc, score = pair
+            coverage = sum(weights[term] for term in weights.keys() & set(tokenize(doc.page_content))) / total
+            return self.weight * coverage + (1 - self.weight) * score / top_score
+        return [doc for doc, _ in sorted(zip(docs, scores), key=blended, reverse=True)]
+
+
+# Cross-encoder reranker (sentence-transformers), loaded on first use
+class CrossEncoderReranker:
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2"):
+        self.model_name = model_name
+        self.model = None
+        self._lock = threading.Lock()
+
+    def rerank(self, query, docs, scores=None, idf=None):
+        with self._lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(self.model_name)
+        scores = self.model.predict([(query, doc.page_content) for doc in docs])
+        ranked = sorted(zip(docs, scores), key=lambda pair: pair[1], reverse=True)
+        return [doc for doc, _ in ranked]
+
+
+def get_reranker(name, model_name=None):
+    if name in (None, "", "none"):
+        return None
+    if name == "lexical":
+        return LexicalReranker()
+    if name == "cross-encoder":
+        return CrossEncoderReranker(model_name) if model_name else CrossEncoderReranker()
+    raise ValueError(f"Unknown RERANKER: {name}")
+
+
+# Dense top fetch_k from the vector store and BM25 top fetch_k from the agent's inverted index,
+# merged with reciprocal rank fusion, optionally reranked, then cut to k. Without a sparse index it
+# is a plain dense retriever. A caller that has already embedded the query (the answer cache lookup)
+# passes embedding= so the query isn't embedded a second time.
+class HybridRetriever(BaseRetriever):
+    vector_db: Any
+    sparse_index: Optional[Any] = None
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    reranker: Optional[Any] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None, embedding=None):
+        timings = {}
+        fetch_k = self.k if self.sparse_index is None else self.fetch_k
+        started = time.perf_counter()
+        if embedding is None:
+            dense_docs = self.vector_db.similarity_search(query, k=fetch_k)
+        else:
+            dense_docs = [doc for doc, _ in search_by_vector(self.vector_db, embedding, fetch_k)]
+        timings["dense_s"] = time.perf_counter() - started
+
+        if self.sparse_index is None:
+            _stage_timings.value = {name: round(seconds, 4) for name, seconds in timings.items()}
+            return dense_docs[:self.k]
+
+        started = time.perf_counter()
+        sparse_docs = [Document(page_content=text, metadata=metadata)
+                       for _, text, metadata, _ in self.sparse_index.search(query, n=self.fetch_k)]
+        timings["sparse_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        fused, scores = {}, {}
+        for docs in (dense_docs, sparse_docs):
+            for rank, doc in enumerate(docs):
+                key = (doc.metadata.get("source"), doc.page_content)
+                fused.setdefault(key, doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked_keys = sorted(scores, key=scores.get, reverse=True)[:self.fetch_k]
+        candidates = [fused[key] for key in ranked_keys]
+        timings["fusion_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if self.reranker is not None:
+            candidates = self.reranker.rerank(query, candidates, scores=[scores[key] for key in ranked_keys],
+                                              idf=self.sparse_index.idf)
+        timings["rerank_s"] = time.perf_counter() - started
+
+        _stage_timings.value = {name: round(seconds, 4) for name, seconds in timings.items()}
+        return candidates[:self.k]
+
+
+def search_by_vector(vector_db, embedding, k):
+    # FAISS and Pinecone name this differently; both score by cosine similarity, higher is closer
+    if hasattr(vector_db, "similarity_search_with_score_by_vector"):
+        return vector_db.similarity_search_with_score_by_vector(embedding, k=k)
+    return vector_db.similarity_search_by_vector_with_score(embedding, k=k)
+
+
+# "Search all agents": the query is embedded once (or passed in as embedding=) and searched in every
+# agent's index at the same time, so a turn waits for the slowest index rather than the sum of them. Indexes that don't answer
+# within timeout seconds are left out. Results are merged by cosine score (all agents share one
+# embedding model), deduplicated by text, and cut to k.
+class MultiAgentRetriever(BaseRetriever):
+    vector_dbs: Dict[str, Any]
+    embeddings: Any
+    k: int = 3
+    timeout: float = 10.0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None, embedding=None):
+        timings = {}
+        if embedding is None:
+            started = time.perf_counter()
+            embedding = self.embeddings.embed_query(query)
+            timings["embed_s"] = time.perf_counter() - started
+
+        def search(vector_db):
+            search_started = time.perf_counter()
+            results = search_by_vector(vector_db, embedding, self.k)
+            return results, time.perf_counter() - search_started
+
+        started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=max(1, len(self.vector_dbs)))
+        futures = {pool.submit(search, vector_db): name for name, vector_db in self.vector_dbs.items()}
+        done, not_done = wait(futures, timeout=self.timeout)
+        # a slow index keeps its thread until it answers, but the turn doesn't wait for it
+        pool.shutdown(wait=False, cancel_futures=True)
+        timings["fanout_s"] = time.perf_counter() - started
+
+        merged = {}
+        for future in done:
+            name = futures[future]
+            try:
+                results, seconds = future.result()
+            except Exception as error:
+                print(f"search in agent {name} failed: {error!r}")
+                timings["failed"] = timings.get("failed", 0) + 1
+                continue
+            timings[f"{name}_s"] = seconds
+            # the same chunk uploaded to two agents would only repeat itself in the prompt
+            for doc, score in results:
+                key = doc.page_content
+                if key not in merged or score > merged[key][1]:
+                    merged[key] = (Document(page_content=doc.page_content, metadata={**doc.metadata, "agent": name}),
+                                   score)
+        for future in not_done:
+            print(f"search in agent {futures[future]} timed out after {self.timeout}s")
+        timings["timed_out"] = len(not_done)
+
+        ranked = sorted(merged.values(), key=lambda pair: pair[1], reverse=True)
+        _stage_timings.value = {name: round(value, 4) for name, value in timings.items()}
+        return [doc for doc, _ in ranked[:self.k]]
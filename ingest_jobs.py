@@ -0,0 +1,243 @@
+# Background ingestion jobs
+# The builder app queues a job (its PDFs copied into a job directory of their own) and returns;
+# detached worker processes claim jobs from a local SQLite queue and run the same
+# chunk -> embed -> upsert pipeline. Progress is written back to the queue for the app to poll.
+# A job whose worker stops sending heartbeats is picked up again and resumes after the
+# last checkpointed batch.
+#
+# Command to run a worker by hand >> python ingest_jobs.py --worker
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+from settings import get_setting
+
+JOBS_DIR = get_setting("JOBS_DIR", os.path.join(".cache", "jobs"))
+DB_FILE = "jobs.sqlite3"
+HEARTBEAT_INTERVAL = 5
+STALE_AFTER = 30
+MAX_ATTEMPTS = 3
+ACTIVE_STATUSES = ("queued", "running")
+
+
+@contextmanager
+def connect():
+    # autocommit connection; claim_job opens its own transaction
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    db = sqlite3.connect(os.path.join(JOBS_DIR, DB_FILE), timeout=30, isolation_level=None)
+    try:
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT, index_name TEXT, status TEXT, work_dir TEXT,
+            attempts INTEGER DEFAULT 0, created REAL, updated REAL, heartbeat REAL,
+            worker TEXT, progress TEXT DEFAULT '{}', error TEXT)""")
+        db.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, pid INTEGER, heartbeat REAL)")
+        yield db
+    finally:
+        db.close()
+
+
+def as_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["progress"] = json.loads(job["progress"] or "{}")
+    return job
+
+
+#### QUEUE ####
+def submit_job(kind, index_name, uploaded_files):
+    job_id = uuid.uuid4().hex[:12]
+    work_dir = os.path.abspath(os.path.join(JOBS_DIR, job_id))
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(data_dir)
+    for file in uploaded_files:
+        with open(os.path.join(data_dir, os.path.basename(file.name)), "wb") as f:
+            f.write(file.getbuffer())
+    now = time.time()
+    with connect() as db:
+        db.execute("INSERT INTO jobs (id, kind, index_name, status, work_dir, created, updated, progress) "
+                   "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                   (job_id, kind, index_name, work_dir, now, now, json.dumps({"files": len(uploaded_files)})))
+    return job_id
+
+
+def get_job(job_id):
+    with connect() as db:
+        return as_job(db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def list_jobs(limit=10):
+    with connect() as db:
+        return [as_job(row) for row in db.execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))]
+
+
+def has_active_job(index_name):
+    with connect() as db:
+        row = db.execute(f"SELECT 1 FROM jobs WHERE index_name = ? AND status IN {ACTIVE_STATUSES}",
+                         (index_name,)).fetchone()
+    return row is not None
+
+
+def claim_job(worker_id):
+    # queued jobs first, then running jobs whose worker went quiet; one running job per agent
+    now = time.time()
+    with connect() as db:
+        db.execute("BEGIN IMMEDIATE")
+        row = db.execute(
+            "SELECT * FROM jobs WHERE (status = 'queued' OR (status = 'running' AND heartbeat < ?)) "
+            "AND index_name NOT IN (SELECT index_name FROM jobs WHERE status = 'running' AND heartbeat >= ?) "
+            "ORDER BY created LIMIT 1", (now - STALE_AFTER, now - STALE_AFTER)).fetchone()
+        if row is None:
+            db.execute("COMMIT")
+            return None
+        if row["attempts"] >= MAX_ATTEMPTS:
+            db.execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+                       (f"gave up after {row['attempts']} attempts; last error: {row['error']}", now, row["id"]))
+            db.execute("COMMIT")
+            return claim_job(worker_id)
+        db.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, heartbeat = ?, "
+                   "updated = ? WHERE id = ?", (worker_id, now, now, row["id"]))
+        db.execute("COMMIT")
+        return as_job(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+
+def finish_job(job_id, status, error=None):
+    with connect() as db:
+        db.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                   (status, error, time.time(), job_id))
+
+
+# Counters the pipeline reports while a job runs (files and pages parsed, chunks embedded, ...).
+# Writes are throttled to one per second; state that must survive a restart is written at once.
+class JobProgress:
+    def __init__(self, job):
+        self.job_id = job["id"]
+        self.resume = job["attempts"] > 1
+        self.values = dict(job["progress"])
+        if self.resume:
+            # files are parsed again on resume; chunks already upserted are counted as skipped
+            for key in ("files_parsed", "pages_parsed", "chunks_embedded", "chunks_skipped"):
+                self.values.pop(key, None)
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.values[key] = self.values.get(key, 0) + value
+        self.flush(force=False)
+
+    def set(self, **values):
+        with self._lock:
+            self.values.update(values)
+        self.flush()
+
+    def flush(self, force=True):
+        now = time.time()
+        if not force and now - self._last_write < 1.0:
+            return
+        self._last_write = now
+        with self._lock:
+            progress = json.dumps(self.values)
+        with connect() as db:
+            db.execute("UPDATE jobs SET progress = ?, updated = ? WHERE id = ?", (progress, now, self.job_id))
+
+
+#### WORKERS ####
+def worker_count():
+    with connect() as db:
+        row = db.execute("SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - STALE_AFTER,)).fetchone()
+    return row[0]
+
+
+def ensure_workers(count):
+    # workers are started detached from the Streamlit process, so jobs outlive the browser session.
+    # Each is registered before it starts, so a quick rerun doesn't start more.
+    missing = count - worker_count()
+    for _ in range(max(0, missing)):
+        worker_id = uuid.uuid4().hex[:12]
+        with connect() as db:
+            db.execute("INSERT INTO workers (id, pid, heartbeat) VALUES (?, NULL, ?)", (worker_id, time.time()))
+        with open(os.path.join(JOBS_DIR, "worker.log"), "a") as log:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", "--worker-id", worker_id],
+                             cwd=os.getcwd(), stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def send_heartbeats(worker_id, current, stop):
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        now = time.time()
+        with connect() as db:
+            db.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, worker_id))
+            if current.get("job_id"):
+                db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (now, current["job_id"]))
+
+
+def run_job(job, progress):
+    import db_creator_app
+    from tracing import span
+    data_folder = os.path.join(job["work_dir"], "data")
+    with span(f"agent.{job['kind']}", agent=job["index_name"], job=job["id"], attempt=job["attempts"]):
+        if job["kind"] == "create":
+            text_chunks = db_creator_app.get_chunks(data_folder, progress=progress)
+            db_creator_app.get_vector_db(text_chunks, job["index_name"], progress=progress)
+        elif db_creator_app.update_vector_db(data_folder, job["index_name"], progress=progress) is None:
+            raise RuntimeError("This agent was built before incremental updates were available")
+
+
+def run_worker(worker_id=None, idle_exit=300, poll_interval=2.0):
+    worker_id = worker_id or uuid.uuid4().hex[:12]
+    with connect() as db:
+        db.execute("INSERT OR REPLACE INTO workers (id, pid, heartbeat) VALUES (?, ?, ?)",
+                   (worker_id, os.getpid(), time.time()))
+    current, stop = {}, threading.Event()
+    threading.Thread(target=send_heartbeats, args=(worker_id, current, stop), daemon=True).start()
+    print(f"worker {worker_id} started")
+    idle_since = time.time()
+    try:
+        while time.time() - idle_since < idle_exit:
+            job = claim_job(worker_id)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            current["job_id"] = job["id"]
+            progress = JobProgress(job)
+            print(f"running job {job['id']} ({job['kind']} {job['index_name']}, attempt {job['attempts']})")
+            try:
+                run_job(job, progress)
+            except Exception as error:
+                print(f"job {job['id']} failed: {error!r}")
+                progress.flush()
+                # back in the queue until MAX_ATTEMPTS, resuming from its last checkpoint
+                finish_job(job["id"], "queued", error=repr(error))
+            else:
+                progress.flush()
+                finish_job(job["id"], "done")
+                shutil.rmtree(job["work_dir"], ignore_errors=True)
+                print(f"job {job['id']} done")
+            current["job_id"] = None
+            idle_since = time.time()
+    finally:
+        stop.set()
+        with connect() as db:
+            db.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Background ingestion worker")
+    parser.add_argument("--worker", action="store_true")
+    parser.add_argument("--worker-id", help=argparse.SUPPRESS)
+    parser.add_argument("--idle-exit", type=float, default=get_setting("INGEST_WORKER_IDLE_EXIT", 300, float),
+                        help="seconds without work before the worker exits")
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker_id, idle_exit=args.idle_exit)
@@ -0,0 +1,131 @@
+import os
+import time
+import hashlib
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from tracing import record_span
+
+
+def list_pdf_files(data_folder):
+    pdf_files = []
+    for filename in sorted(os.listdir(data_folder)):
+        if filename.lower().endswith(".pdf"):
+            pdf_files.append(os.path.join(data_folder, filename))
+    return pdf_files
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def doc_id_for(path):
+    # stable per file name, so a re-uploaded file with new content replaces its old chunks
+    return hashlib.sha256(os.path.basename(path).encode("utf-8")).hexdigest()[:16]
+
+
+# Vector ids look like "<doc_id>#<file_hash>#<chunk number>" so an index can be diffed
+# against uploaded files by listing its ids alone
+def make_chunk_id(doc_id, file_hash, chunk_number):
+    return f"{doc_id}#{file_hash}#{chunk_number}"
+
+
+def parse_chunk_id(chunk_id):
+    parts = chunk_id.split("#")
+    if len(parts) != 3:
+        return None
+    return parts[0], parts[1]
+
+
+def load_pdf(path):
+    # runs inside a worker process, one file per task; returns the parse time for tracing
+    from langchain.document_loaders import PyPDFLoader
+    started = time.perf_counter()
+    pages = PyPDFLoader(path).load()
+    doc_id, file_hash = doc_id_for(path), file_sha256(path)
+    for page in pages:
+        # the upload folder may be a job directory that is deleted afterwards: keep only the file name
+        page.metadata["source"] = os.path.basename(path)
+        page.metadata["doc_id"] = doc_id
+        page.metadata["file_hash"] = file_hash
+    return pages, time.perf_counter() - started
+
+
+def iter_pdf_pages(data_folder, max_workers=None, max_in_flight=None, pdf_files=None):
+    # Parse PDFs in a process pool and yield the pages of each file as soon as it is done.
+    # At most max_in_flight files are parsed or waiting to be consumed at any time,
+    # so peak memory depends on the queue size and not on the size of the corpus.
+    if pdf_files is None:
+        pdf_files = list_pdf_files(data_folder)
+    if not pdf_files:
+        return
+    # loaded before the pool starts, so forked workers inherit the PDF loader instead of each importing it
+    from langchain.document_loaders import PyPDFLoader
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(pdf_files)))
+    max_in_flight = max(max_workers, max_in_flight or 2 * max_workers)
+    remaining = iter(pdf_files)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {pool.submit(load_pdf, path) for path in islice(remaining, max_in_flight)}
+        try:
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pages, seconds = future.result()
+                    if pages:
+                        record_span("pdf.load", seconds, file=pages[0].metadata["source"],
+                                    pages=len(pages), bytes=sum(len(page.page_content) for page in pages))
+                    yield pages
+                for path in islice(remaining, max_in_flight - len(in_flight)):
+                    in_flight.add(pool.submit(load_pdf, path))
+        finally:
+            # consumer stopped early or a file failed: drop the queued work
+            for future in in_flight:
+                future.cancel()
+
+
+# text_splitter defaults to 500-character chunks; page_filter gets the pages of one file before splitting
+def iter_chunks(data_folder, chunk_size=500, chunk_overlap=50, max_workers=None, max_in_flight=None, pdf_files=None,
+                text_splitter=None, page_filter=None):
+    if text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for pages in iter_pdf_pages(data_folder, max_workers=max_workers, max_in_flight=max_in_flight, pdf_files=pdf_files):
+        if page_filter is not None:
+            pages = page_filter(pages)
+        started = time.perf_counter()
+        chunks = text_splitter.split_documents(pages)
+        record_span("split", time.perf_counter() - started, chunks=len(chunks),
+                    bytes=sum(len(chunk.page_content) for chunk in chunks))
+        for chunk_number, chunk in enumerate(chunks):
+            chunk.metadata["chunk_id"] = make_chunk_id(chunk.metadata["doc_id"], chunk.metadata["file_hash"], chunk_number)
+            yield chunk
+
+
+# same ids and sources as iter_chunks, for chunks produced by the serial DirectoryLoader path
+def assign_chunk_ids(text_chunks):
+    files = {}
+    for chunk in text_chunks:
+        source = chunk.metadata["source"]
+        if source not in files:
+            files[source] = {"doc_id": doc_id_for(source), "file_hash": file_sha256(source), "count": 0}
+        info = files[source]
+        chunk.metadata["doc_id"] = info["doc_id"]
+        chunk.metadata["file_hash"] = info["file_hash"]
+        chunk.metadata["chunk_id"] = make_chunk_id(info["doc_id"], info["file_hash"], info["count"])
+        chunk.metadata["source"] = os.path.basename(source)
+        info["count"] += 1
+    return text_chunks
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
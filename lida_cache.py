@@ -0,0 +1,192 @@
+import os
+import json
+import shutil
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+from lida.datamodel import Goal, ChartExecutorResponse
+from settings import get_setting
+
+# Disk cache for LIDA dataset profiling. One directory per (dataset content, TextGenerationConfig)
+# holds summary.json, goals-<n>.json and charts/<goal hash>.json, so a rerun on the same dataset
+# makes no LLM calls and does not re-profile the data. Reads touch the directory, and the least
+# recently used directories are removed once the cache grows past LIDA_CACHE_MAX_MB.
+
+_fingerprints = {}
+_lock = threading.Lock()
+_data_lock = threading.Lock()
+_render_lock = threading.Lock()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_fingerprint(dataset):
+    # local files are keyed by content (memoised on mtime and size); example datasets by URL
+    if not os.path.isfile(dataset):
+        return "url:" + dataset
+    stat = os.stat(dataset)
+    memo_key = (os.path.abspath(dataset), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if memo_key not in _fingerprints:
+            _fingerprints[memo_key] = "sha256:" + file_sha256(dataset)
+        return _fingerprints[memo_key]
+
+
+def register_fingerprint(path, fingerprint):
+    # for files whose content hash is already known, e.g. converted uploads named after it
+    stat = os.stat(path)
+    with _lock:
+        _fingerprints[(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)] = fingerprint
+
+
+def config_fingerprint(textgen_config):
+    return json.dumps(dict(textgen_config), sort_keys=True, default=str)
+
+
+class LidaCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, dataset, textgen_config):
+        text = dataset_fingerprint(dataset) + "\0" + config_fingerprint(textgen_config)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+    def _path(self, key, name):
+        return os.path.join(self.cache_dir, key, name)
+
+    def get(self, key, name):
+        path = self._path(key, name)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(os.path.join(self.cache_dir, key))
+        return value
+
+    def put(self, key, name, value):
+        path = self._path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f, default=str)
+        os.replace(tmp_path, path)
+        os.utime(os.path.join(self.cache_dir, key))
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, file))
+                       for root, _, files in os.walk(entry_dir) for file in files)
+            entries.append((os.path.getmtime(entry_dir), name, size))
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            print(f"evicting LIDA cache entry {name}")
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
+
+
+def get_lida_cache():
+    return LidaCache(get_setting("LIDA_CACHE_DIR", os.path.join(".cache", "lida")),
+                     get_setting("LIDA_CACHE_MAX_MB", 200, int) * 1024 * 1024)
+
+
+# summarize_fn replaces lida.summarize, e.g. for converted uploads profiled from a sample
+def cached_summarize(cache, lida, dataset, summary_method, textgen_config, summarize_fn=None):
+    key = cache.key(dataset, textgen_config)
+    summary = cache.get(key, "summary.json")
+    if summary is None:
+        if summarize_fn is not None:
+            summary = summarize_fn(lida, dataset, summary_method, textgen_config)
+        else:
+            summary = lida.summarize(dataset, summary_method=summary_method, textgen_config=textgen_config)
+        cache.put(key, "summary.json", summary)
+    return summary
+
+
+def cached_goals(cache, lida, dataset, summary, n, textgen_config):
+    key = cache.key(dataset, textgen_config)
+    goals = cache.get(key, f"goals-{n}.json")
+    if goals is None:
+        goals = lida.goals(summary, n=n, textgen_config=textgen_config)
+        cache.put(key, f"goals-{n}.json", [asdict(goal) for goal in goals])
+        return goals
+    return [Goal(**goal) for goal in goals]
+
+
+def as_goal(goal):
+    if isinstance(goal, Goal):
+        return goal
+    return Goal(question=goal, visualization=goal, rationale="")
+
+
+def chart_name(goal, library):
+    text = f"{library}\0{goal.question}\0{goal.visualization}"
+    return "charts/" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16] + ".json"
+
+
+# Code generation is an LLM call and runs concurrently; executing the code draws on
+# matplotlib's global pyplot state, so one chart is rendered at a time
+def generate_chart(lida, summary, goal, textgen_config, library="seaborn"):
+    lida.check_textgen(config=textgen_config)
+    code_specs = lida.vizgen.generate(summary=summary, goal=goal, textgen_config=textgen_config,
+                                      text_gen=lida.text_gen, library=library)
+    with _render_lock:
+        return lida.execute(code_specs=code_specs, data=lida.data, summary=summary, library=library)
+
+
+# load_data is only called on a miss: the chart code runs against the dataframe,
+# which lida.summarize would have loaded if the summary had not come from the cache
+def cached_visualize(cache, lida, dataset, summary, goal, textgen_config, load_data, library="seaborn"):
+    key = cache.key(dataset, textgen_config)
+    goal = as_goal(goal)
+    charts = cache.get(key, chart_name(goal, library))
+    if charts is not None:
+        return [ChartExecutorResponse(**chart) for chart in charts]
+    with _data_lock:
+        if lida.data is None:
+            lida.data = load_data(dataset)
+    charts = generate_chart(lida, summary, goal, textgen_config, library)
+    # failed charts are not cached, so asking again retries the generation
+    if charts and all(chart.status for chart in charts):
+        cache.put(key, chart_name(goal, library), [asdict(chart) for chart in charts])
+    return charts
+
+
+# Renders every goal on a pool of max_workers threads and yields (position, goal, charts, seconds)
+# as each one finishes, so the page can fill in charts in completion order
+def iter_visualize_all(cache, lida, dataset, summary, goals, textgen_config, load_data,
+                       library="seaborn", max_workers=4):
+    def render(goal):
+        started = time.perf_counter()
+        charts = cached_visualize(cache, lida, dataset, summary, goal, textgen_config, load_data, library)
+        return charts, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(render, goal): (position, goal) for position, goal in enumerate(goals)}
+        for future in as_completed(futures):
+            position, goal = futures[future]
+            try:
+                charts, seconds = future.result()
+            except Exception as error:
+                print(f"chart for goal {position} failed: {error}")
+                charts, seconds = [], 0.0
+            yield position, as_goal(goal), charts, seconds
@@ -0,0 +1,133 @@
+import streamlit as st
+from answer_cache import SemanticAnswerCache
+from sparse_index import BM25Index
+from settings import get_setting
+
+# Process-wide resources shared by every session and rerun. st.cache_resource keeps one object per
+# argument set until its TTL expires or it is cleared, so HTTP clients and their connection pools
+# are reused instead of being rebuilt on each widget interaction.
+# Each factory imports its client library when it first runs, so importing this module is cheap.
+CLIENT_TTL = get_setting("CLIENT_CACHE_TTL", 3600, int)
+AGENT_TTL = get_setting("AGENT_CACHE_TTL", 900, int)
+INDEX_LIST_TTL = get_setting("INDEX_LIST_CACHE_TTL", 60, int)
+
+
+@st.cache_resource(ttl=CLIENT_TTL, show_spinner=False)
+def get_backend():
+    from vector_store import get_vector_store_backend
+    return get_vector_store_backend()
+
+
+@st.cache_resource(ttl=CLIENT_TTL, show_spinner=False)
+def get_embeddings(model="text-embedding-ada-002"):
+    if get_setting("EMBEDDINGS_BACKEND", "openai") == "fake":
+        from fakes import HashEmbeddings
+        return HashEmbeddings()
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model)
+
+
+@st.cache_resource(ttl=CLIENT_TTL, show_spinner=False)
+def get_chat_llm(model="gpt-3.5-turbo-1106", streaming=False):
+    if get_setting("LLM_BACKEND", "openai") == "fake":
+        from fakes import FakeStreamingChatModel
+        return FakeStreamingChatModel(streaming=streaming,
+                                      first_token_delay=get_setting("FAKE_LLM_FIRST_TOKEN_DELAY", 0.2, float),
+                                      token_delay=get_setting("FAKE_LLM_TOKEN_DELAY", 0.02, float))
+    from langchain.chat_models import ChatOpenAI
+    from langchain.callbacks import LLMonitorCallbackHandler
+    handler = LLMonitorCallbackHandler()
+    return ChatOpenAI(model=model, streaming=streaming, callbacks=[handler])
+
+
+# index_version is part of the cache key, so an agent rebuilt by the builder app
+# (another process) is reloaded on the next rerun instead of after the TTL
+@st.cache_resource(ttl=AGENT_TTL, show_spinner=False)
+def get_vector_db(index_name, index_version=None):
+    return get_backend().get_vector_db(index_name, get_embeddings())
+
+
+@st.cache_resource(ttl=AGENT_TTL, show_spinner=False)
+def get_sparse_index(index_name, index_version=None):
+    return BM25Index.load(get_backend().local_path(index_name))
+
+
+@st.cache_resource(ttl=AGENT_TTL, show_spinner=False)
+def get_reranker_model(name, model_name=None):
+    from hybrid_retriever import get_reranker
+    return get_reranker(name, model_name)
+
+
+# RETRIEVER_MODE=hybrid fuses dense and BM25 results; agents without a BM25 index stay dense-only
+@st.cache_resource(ttl=AGENT_TTL, show_spinner=False)
+def get_retriever(index_name, index_version=None, k=3):
+    from hybrid_retriever import HybridRetriever
+    vector_db = get_vector_db(index_name, index_version)
+    sparse_index = get_sparse_index(index_name, index_version)
+    if get_setting("RETRIEVER_MODE", "hybrid") != "hybrid" or sparse_index is None:
+        return HybridRetriever(vector_db=vector_db, k=k)
+    reranker = get_reranker_model(get_setting("RERANKER", "lexical"), get_setting("RERANKER_MODEL"))
+    return HybridRetriever(vector_db=vector_db, sparse_index=sparse_index, k=k,
+                           fetch_k=get_setting("HYBRID_FETCH_K", 20, int), reranker=reranker)
+
+
+# one retriever over several agents' indexes, searched concurrently ("search all agents")
+@st.cache_resource(ttl=AGENT_TTL, show_spinner=False)
+def get_multi_agent_retriever(index_names, index_versions=None, k=3, timeout=10.0):
+    from hybrid_retriever import MultiAgentRetriever
+    vector_dbs = {name: get_vector_db(name, version) for name, version in zip(index_names, index_versions)}
+    return MultiAgentRetriever(vector_dbs=vector_dbs, embeddings=get_embeddings(), k=k, timeout=timeout)
+
+
+# index_name may also be a list of agents, which are then searched together
+def get_agent_retriever(index_name, k=3):
+    if isinstance(index_name, (list, tuple)):
+        index_names = tuple(index_name)
+        return get_multi_agent_retriever(index_names, tuple(get_index_version(name) for name in index_names), k,
+                                         get_setting("FANOUT_TIMEOUT", 10.0, float))
+    return get_retriever(index_name, get_index_version(index_name), k)
+
+
+@st.cache_data(ttl=INDEX_LIST_TTL, show_spinner=False)
+def get_index_version(index_name):
+    return get_backend().index_version(index_name)
+
+
+# one answer cache per agent version: updating an agent's index starts a fresh cache
+@st.cache_resource(ttl=AGENT_TTL, show_spinner=False)
+def get_answer_cache(index_name, index_version=None):
+    return SemanticAnswerCache(threshold=get_setting("ANSWER_CACHE_THRESHOLD", 0.95, float),
+                               ttl=get_setting("ANSWER_CACHE_TTL", 86400, int),
+                               max_entries=get_setting("ANSWER_CACHE_MAX_ENTRIES", 1000, int))
+
+
+def get_agent_answer_cache(index_name):
+    if not get_setting("ANSWER_CACHE", True, bool):
+        return None
+    if isinstance(index_name, (list, tuple)):
+        # agents searched together share a cache keyed by all of their versions
+        return get_answer_cache("+".join(index_name), tuple(get_index_version(name) for name in index_name))
+    return get_answer_cache(index_name, get_index_version(index_name))
+
+
+@st.cache_data(ttl=INDEX_LIST_TTL, show_spinner=False)
+def list_agent_indexes():
+    return get_backend().list_indexes()
+
+
+# call after an agent is created, updated or deleted in this process
+def invalidate_agents():
+    get_answer_cache.clear()
+    get_index_version.clear()
+    get_multi_agent_retriever.clear()
+    get_retriever.clear()
+    get_sparse_index.clear()
+    get_vector_db.clear()
+    list_agent_indexes.clear()
+
+
+def invalidate_clients():
+    invalidate_agents()
+    get_chat_llm.clear()
+    get_embeddings.clear()
+    get_backend.clear()
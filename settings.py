@@ -0,0 +1,19 @@
+import os
+import streamlit as st
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+# Look up a tunable in the environment (.env) first, then in st.secrets
+def get_setting(name, default=None, cast=str):
+    value = os.getenv(name)
+    if value is None:
+        try:
+            value = st.secrets.get(name)
+        except Exception:
+            value = None
+    if value is None or value == "":
+        return default
+    if cast is bool:
+        return value if isinstance(value, bool) else str(value).lower() in TRUE_VALUES
+    return cast(value)
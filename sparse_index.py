@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+SPARSE_INDEX_FILE = "bm25.json"
+# keeps error codes, SKUs and versions ("ERR-404", "SKU_1234", "v2.1") as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+# BM25 inverted index over chunk texts, built at ingestion time and stored next to the
+# agent's vectors as bm25.json. Postings map term -> [[doc number, term frequency], ...].
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self.doc_lens = []
+        self.postings = {}
+        self._dirty = False
+
+    @property
+    def avg_doc_len(self):
+        return sum(self.doc_lens) / len(self.doc_lens) if self.doc_lens else 0.0
+
+    def add(self, records):
+        # records: (id, text, metadata); re-adding an id replaces it
+        position = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        for vector_id, text, metadata in records:
+            if vector_id in position:
+                i = position[vector_id]
+                self.texts[i], self.metadatas[i] = text, metadata
+            else:
+                position[vector_id] = len(self.ids)
+                self.ids.append(vector_id)
+                self.texts.append(text)
+                self.metadatas.append(metadata)
+        self._dirty = True
+
+    def delete(self, ids):
+        ids = set(ids)
+        keep = [i for i, vector_id in enumerate(self.ids) if vector_id not in ids]
+        if len(keep) == len(self.ids):
+            return
+        self.ids = [self.ids[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._dirty = True
+
+    def build(self):
+        self.postings = {}
+        self.doc_lens = []
+        for doc_number, text in enumerate(self.texts):
+            terms = Counter(tokenize(text))
+            self.doc_lens.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append([doc_number, tf])
+        self._dirty = False
+
+    def idf(self, term):
+        # 0 for terms no chunk contains, so they can't weigh on any score
+        if self._dirty:
+            self.build()
+        postings = self.postings.get(term)
+        if not postings:
+            return 0.0
+        return math.log(1 + (len(self.ids) - len(postings) + 0.5) / (len(postings) + 0.5))
+
+    def search(self, query, n=10):
+        if self._dirty:
+            self.build()
+        avg_doc_len = self.avg_doc_len or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_number, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_number] / avg_doc_len)
+                scores[doc_number] = scores.get(doc_number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(self.ids[i], self.texts[i], self.metadatas[i], score) for i, score in ranked]
+
+    def save(self, path):
+        if self._dirty:
+            self.build()
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, SPARSE_INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "ids": self.ids, "texts": self.texts,
+                       "metadatas": self.metadatas, "doc_lens": self.doc_lens, "postings": self.postings}, f)
+        os.replace(tmp_path, os.path.join(path, SPARSE_INDEX_FILE))
+
+    @classmethod
+    def load(cls, path):
+        # returns None for agents built before the sparse index existed
+        index_path = os.path.join(path, SPARSE_INDEX_FILE)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path) as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.ids, index.texts, index.metadatas = data["ids"], data["texts"], data["metadatas"]
+        index.doc_lens, index.postings = data["doc_lens"], data["postings"]
+        return index
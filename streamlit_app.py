@@ -5,63 +5,84 @@
 # Command to launch >> streamlit run streamlit_app.py
 
 import streamlit as st
-from streamlit_chat import message
+#from streamlit_chat import message
 from dotenv import load_dotenv
 import os 
+import re
 #from langchain.document_loaders import DirectoryLoader, PyPDFLoader
 #from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-#from langchain.vectorstores import FAISS
-from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain.callbacks import LLMonitorCallbackHandler
-from langchain.vectorstores import Pinecone  
-from pinecone import Pinecone as pinecone_Pinecone
-from pinecone import ServerlessSpec
 from streamlit_feedback import streamlit_feedback
+from tracing import span, show_trace_sidebar
+from settings import get_setting
+from resources import get_chat_llm, get_embeddings, get_agent_retriever, get_agent_answer_cache, list_agent_indexes
+from warmup import warm_up
 
+# langchain is imported by the functions that use it; these are loaded in the background after the
+# first page is shown, so the chain is usually ready to build when Go is pressed
+WARMUP_MODULES = ["langchain.chains", "langchain.memory", "langchain.chat_models", "langchain.embeddings.openai",
+                  "timing", "hybrid_retriever", "faiss_store", "faiss"]
 
 
-def initialize_session_state():
-    if 'history' not in st.session_state:
-        st.session_state['history'] = []
 
+def initialize_session_state():
     if 'generated' not in st.session_state:
         st.session_state['generated'] = ["Hello! Ask me a question 🤗"]
 
     if 'past' not in st.session_state:
         st.session_state['past'] = ["Hey! 👋"]
 
+    if 'timings' not in st.session_state:
+        st.session_state['timings'] = []
+
 
 
 def get_conversation_chain(selected_index):
     print("get conversation chain called")
     #check for password
-    if st.session_state.password != st.secrets.APP_PASSWORD:
+    if st.session_state.password != get_setting("APP_PASSWORD"):
         st.warning("Incorrect Password")
         return
-    handler = LLMonitorCallbackHandler()
-    embeddings = OpenAIEmbeddings()
-    pc = pinecone_Pinecone(api_key=st.secrets["PINECONE_API_KEY"])
-    index_name = selected_index
-    vector_db = Pinecone.from_existing_index(index_name, embeddings)
-    llm = ChatOpenAI(model = 'gpt-3.5-turbo-1106', callbacks=[handler])
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-    st.session_state.retriever=vector_db.as_retriever(search_kwargs={"k": 3})
+    if not selected_index:
+        st.warning("Please select an agent")
+        return
+    from langchain.chains import ConversationalRetrievalChain
+    # clients, embeddings, llm and retriever are shared across sessions (see resources.py);
+    # only the chat memory belongs to this session.
+    # A list of agents gets one retriever that searches all of them concurrently, then one LLM call.
+    index_name = selected_index if isinstance(selected_index, str) else ", ".join(selected_index)
+    # in streaming mode only the answer llm streams; question condensation stays a plain call
+    llm = get_chat_llm('gpt-3.5-turbo-1106', streaming=get_setting("STREAMING", True, bool))
+    condense_llm = get_chat_llm('gpt-3.5-turbo-1106')
+    memory = get_chat_memory(condense_llm)
+    st.session_state.retriever = get_agent_retriever(selected_index, k=3)
     conversation_chain = ConversationalRetrievalChain.from_llm(
         llm=llm, 
+        condense_question_llm=condense_llm,
         chain_type='stuff', 
         retriever=st.session_state.retriever,
         memory=memory, 
-        callbacks=[handler],
-        #return_source_documents = True
+        callbacks=llm.callbacks,
+        return_source_documents = True
         )
+    st.session_state.agent_name = index_name
+    st.session_state.agent_indexes = selected_index
     st.success("Custom Agent selected: "+index_name)
     return conversation_chain
 
 
 
+def get_chat_memory(llm):
+    from langchain.memory import ConversationBufferMemory, ConversationSummaryBufferMemory
+    # output_key tells the memory which output to store now that source documents are returned too
+    if get_setting("MEMORY_MODE", "summary") == "buffer":
+        return ConversationBufferMemory(memory_key="chat_history", return_messages=True, output_key="answer")
+    # recent turns are kept verbatim up to the token budget (counted with tiktoken by the llm),
+    # older turns are folded into a rolling summary so the condense prompt stops growing
+    return ConversationSummaryBufferMemory(llm=llm, max_token_limit=get_setting("MEMORY_MAX_TOKENS", 1000, int),
+                                           memory_key="chat_history", return_messages=True, output_key="answer")
+
+
+
 #### USER INQUIRY ####
 def display_chats():
     print("display chats method called")
@@ -78,6 +99,7 @@ def display_chats():
     #             message(st.session_state["past"][i], is_user=True, key=str(i) + '_user', avatar_style="thumbs")
     #             message(st.session_state["generated"][i], key=str(i), avatar_style="fun-emoji") 
     
+    pending_question = st.session_state.pop('pending_question', None)
     if st.session_state['generated']:
          with reply_container:
              for i in range(len(st.session_state['generated'])):
@@ -85,50 +107,111 @@ def display_chats():
                     st.write(st.session_state["past"][i])
                 with st.chat_message("assistant"):
                     st.write(st.session_state["generated"][i]) 
-                    if i == len(st.session_state['generated'])-1:
+                    if i == len(st.session_state['generated'])-1 and pending_question is None:
                         streamlit_feedback(feedback_type="thumbs",optional_text_label="[Optional] Please provide an explanation",align="flex-start")
 
+    # streaming mode: answer the new question here so tokens render inside its chat message
+    if pending_question is not None:
+        with reply_container:
+            with st.chat_message("user"):
+                st.write(pending_question)
+            with st.chat_message("assistant"):
+                handle_user_question(pending_question, placeholder=st.empty())
+                streamlit_feedback(feedback_type="thumbs",optional_text_label="[Optional] Please provide an explanation",align="flex-start")
+
 
 def submit():
     print ("Submit method called")
     st.session_state.user_question = st.session_state.input
     st.session_state.input = ""
+    if get_setting("STREAMING", True, bool):
+        st.session_state.pending_question = st.session_state.user_question
+        return
     with st.spinner('Generating Response...'):
         handle_user_question(st.session_state['user_question'])
     return
 
-def handle_user_question(user_question):
+def handle_user_question(user_question, placeholder=None):
     print("handle user question called")
     if 'chain' not in st.session_state:
         st.warning("No Agent is selected. Please select agent, enter password and press go")
         return
 
+    from timing import TurnTimingHandler, SpanCallbackHandler, StreamlitTokenHandler
+    from hybrid_retriever import pop_last_stage_timings
     mychain = st.session_state.chain
-    result = mychain({"question": user_question, "chat_history": st.session_state['history']})
-    st.session_state['history'].append((user_question, result["answer"]))
-    src_docs = st.session_state.retriever.get_relevant_documents(user_question)
-    unique_ref_text = get_unique_references(src_docs)
-    st.session_state['past'].append(user_question)
-    st.session_state['generated'].append(result["answer"] + "\n\n" + "To Learn more, visit: \n" + unique_ref_text) 
+    timer = TurnTimingHandler()
+    callbacks = [timer, SpanCallbackHandler()]
+    if placeholder is not None:
+        callbacks.append(StreamlitTokenHandler(placeholder))
+    with span("question", agent=st.session_state.agent_name, question_chars=len(user_question)) as trace:
+        st.session_state.last_trace = trace
+        # the chain's steps are run one by one so the answer cache can sit between
+        # question condensation and retrieval
+        with span("condense"):
+            standalone_question = condense_question(mychain, user_question, callbacks)
+        answer_cache = get_agent_answer_cache(st.session_state.agent_indexes)
+        cached = question_vector = None
+        if answer_cache is not None:
+            with span("answer_cache") as lookup:
+                question_vector = get_embeddings().embed_query(standalone_question)
+                cached = answer_cache.lookup(question_vector, standalone_question)
+                lookup.set(hit=cached is not None)
+        if cached is not None:
+            answer, unique_ref_text = cached
+        else:
+            # references come from the documents the model actually saw (retrieved for the condensed question);
+            # the vector from the cache lookup is reused so the question is embedded once per turn
+            with span("retrieval") as retrieval:
+                src_docs = mychain.retriever.get_relevant_documents(standalone_question, callbacks=callbacks,
+                                                                    embedding=question_vector)
+                retrieval.set(docs=len(src_docs), bytes=sum(len(doc.page_content) for doc in src_docs),
+                              **pop_last_stage_timings())
+            with span("generation") as generation:
+                answer = mychain.combine_docs_chain.run(input_documents=src_docs, question=standalone_question, callbacks=callbacks)
+                generation.set(answer_chars=len(answer))
+            unique_ref_text = get_unique_references(src_docs)
+            if answer_cache is not None:
+                answer_cache.add(question_vector, answer, unique_ref_text, standalone_question)
+        timings = timer.stop().as_dict()
+        timings["answer_cache_hit"] = cached is not None
+        if cached is None:
+            timings["retrieval_stages"] = {key: value for key, value in retrieval.attributes.items() if key.endswith("_s")}
+        st.session_state['timings'].append(timings)
+        print("turn timings:", st.session_state['timings'][-1])
+        answer_text = answer + "\n\n" + "To Learn more, visit: \n" + unique_ref_text
+        if placeholder is not None:
+            placeholder.write(answer_text)
+        st.session_state['past'].append(user_question)
+        st.session_state['generated'].append(answer_text) 
+        # saved after the answer is shown: folding old turns into the summary may take an LLM call
+        with span("memory.save"):
+            mychain.memory.save_context({"question": user_question}, {"answer": answer})
     return
 
+def condense_question(chain, user_question, callbacks=None):
+    # same rephrasing ConversationalRetrievalChain does; the first question needs no LLM call
+    from langchain.schema import get_buffer_string
+    chat_history = chain.memory.load_memory_variables({})["chat_history"]
+    if not chat_history:
+        return user_question
+    return chain.question_generator.run(question=user_question, chat_history=get_buffer_string(chat_history), callbacks=callbacks)
+
 def get_unique_references(src_docs):
     # create list of sources
     src_list = []
     for doc in src_docs:
-        src_list.append(doc.metadata.get('source').rpartition("\\")[-1])
+        # agents built before sources were stored as file names hold full Windows or POSIX paths
+        src_list.append(re.split(r"[\\/]", doc.metadata.get('source'))[-1])
     #deduplicate
     unique_src_list = list(dict.fromkeys(src_list))
     unique_ref_text = "\n".join(unique_src_list)
     return unique_ref_text
 
-def get_pinecone_index_list():
-   pc = pinecone_Pinecone(api_key=st.secrets["PINECONE_API_KEY"])
-   index_names=[]
-   active_indexes = pc.list_indexes()
-   for indexes in active_indexes:
-       print(indexes['name'])
-       index_names.append(indexes['name']) 
+def get_agent_index_list():
+   # Pinecone or local FAISS indexes depending on the VECTOR_STORE setting, cached for a short TTL
+   index_names = list(list_agent_indexes())
+   print(index_names)
    return index_names
     
 
@@ -141,25 +224,31 @@ def main():
     st.subheader("WMC Chat-Agents Playground :seedling:")
     sideb = st.sidebar
     #st.sidebar.title("Select Pinecone Index")
-    agent_list = get_pinecone_index_list()
+    agent_list = get_agent_index_list()
     agent_list.append("wmc-data-governance (placeholder)")
     agent_list.append("wmc-data-enablement (placeholder)")
     agent_list.append("wmc-eoc-insights (placeholder)")
     agent_list.append("wmc-onboarding (placeholder)")
-    selected_index = sideb.selectbox(
-        "Select an agent",
-        # Need to fetch this list from the Pinecone Index 
-        options = agent_list , #["wmc-faq", "wmc-data-gov", "wmc-sales-presentations","wmc-creatives-builder", "wmc-test1"],
-        index=None,
-        placeholder="Choose agent")
+    if sideb.checkbox("Search all agents", key='search_all'):
+        # placeholders have no index to search
+        searchable = [name for name in agent_list if not name.endswith("(placeholder)")]
+        selected_index = sideb.multiselect("Agents to search", options=searchable, default=searchable)
+    else:
+        selected_index = sideb.selectbox(
+            "Select an agent",
+            # Need to fetch this list from the Pinecone Index 
+            options = agent_list , #["wmc-faq", "wmc-data-gov", "wmc-sales-presentations","wmc-creatives-builder", "wmc-test1"],
+            index=None,
+            placeholder="Choose agent")
     sideb.text_input("Password", type = "password", placeholder="Enter Password", key='password')
     if st.sidebar.button("Go"):
         with st.spinner("Connecting to vector dB"):
             st.session_state.chain = get_conversation_chain(selected_index)
     if st.sidebar.button("Clear History"):
-        st.session_state['history'] = []
         st.session_state['generated'] = ["Hello! Ask me a question 🤗"]
         st.session_state['past'] = ["Hey! 👋"]
+        if st.session_state.get('chain') is not None:
+            st.session_state.chain.memory.clear()
     st.sidebar.write("\n\n\n\n")
     st.sidebar.write("### Caution")
     st.sidebar.write("Experimental prototype may have bugs")
@@ -172,6 +261,8 @@ def main():
     
 
     display_chats()
+    show_trace_sidebar(st.session_state.get('last_trace'))
+    warm_up(WARMUP_MODULES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,25 @@
+import numpy as np
+from answer_cache import SemanticAnswerCache
+
+
+def unit(seed):
+    rng = np.random.default_rng(seed)
+    vector = rng.normal(size=64)
+    return vector / np.linalg.norm(vector)
+
+
+def test_near_miss_with_another_error_code_is_not_served():
+    cache = SemanticAnswerCache(threshold=0.95)
+    vector = unit(0)
+    cache.add(vector, "E1042 means the disk is full", "errors.pdf", question="What does error E1042 mean?")
+    # ada-002 puts questions that differ only in the code well above the threshold
+    near = vector + 0.01 * unit(1)
+    assert cache.lookup(near, "What does error E1043 mean?") is None
+    assert cache.lookup(near, "What does the error E1042 mean?") == ("E1042 means the disk is full", "errors.pdf")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_dissimilar_question_misses():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.add(unit(0), "answer", "refs", question="How do I reset my password?")
+    assert cache.lookup(unit(2), "How do I reset my password?") is None
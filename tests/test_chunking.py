@@ -0,0 +1,32 @@
+from langchain.schema import Document
+from chunking import ChunkCleaner
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_short_pages_keep_their_lines():
+    # slides with a title and two bullets: every line is at the edge of its page
+    pages = [Document(page_content=f"Quarterly review\nRevenue grew\nCosts fell\nSlide {i}") for i in range(4)]
+    cleaner = ChunkCleaner(count_words)
+    cleaner.clean_pages(pages)
+    assert all(page.page_content.startswith("Quarterly review\nRevenue grew") for page in pages)
+    assert cleaner.stats["boilerplate_lines"] == 0
+
+
+def test_long_pages_lose_repeated_header_and_footer():
+    topics = ["hiring", "leave", "travel", "expenses"]
+    pages = [Document(page_content="\n".join(["ACME Handbook"] + [f"{topic} rule {word}" for word in "abcdef"]
+                                             + [f"Page {i + 1} of 4"]))
+             for i, topic in enumerate(topics)]
+    ChunkCleaner(count_words).clean_pages(pages)
+    assert all("ACME Handbook" not in page.page_content and "Page" not in page.page_content for page in pages)
+    assert all(page.page_content.count("\n") == 5 for page in pages)
+
+
+def test_duplicates_are_only_dropped_within_a_file():
+    text = "The warranty covers parts and labour for two years from the date of purchase"
+    chunks = [Document(page_content=text, metadata={"doc_id": doc_id}) for doc_id in ("a", "b", "a")]
+    kept = list(ChunkCleaner(count_words).filter(chunks))
+    assert [chunk.metadata["doc_id"] for chunk in kept] == ["a", "b"]
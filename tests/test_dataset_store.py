@@ -0,0 +1,31 @@
+import io
+import numpy as np
+import pandas as pd
+import dataset_store
+
+
+class Upload(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def test_blank_csv_cells_are_nulls_like_pandas(tmp_path):
+    rng = np.random.default_rng(0)
+    rows = 20000
+    frame = pd.DataFrame({"city": rng.choice(["Oslo", "Lima", "Pune"], rows),
+                          "amount": rng.integers(0, 100, rows).astype(float)})
+    frame.loc[rng.random(rows) < 0.5, "city"] = None
+    frame.loc[rng.random(rows) < 0.3, "amount"] = None
+    data = frame.to_csv(index=False).encode()
+    expected = pd.read_csv(io.BytesIO(data))
+
+    path = dataset_store.convert_upload(Upload(data, "blanks.csv"), data_dir=str(tmp_path))
+    row_count, stats = dataset_store.column_stats(path)
+
+    assert row_count == len(expected)
+    for column in expected.columns:
+        assert stats[column]["null_count"] == expected[column].isna().sum()
+        assert stats[column]["num_unique_values"] == expected[column].nunique()
+    sample = dataset_store.load_sample(path, n=rows)
+    assert sample["city"].isna().sum() == expected["city"].isna().sum()
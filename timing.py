@@ -0,0 +1,76 @@
+import time
+from langchain.callbacks.base import BaseCallbackHandler
+from tracing import current_span
+
+
+# Collects per-turn timings from chain callbacks: how many retriever and LLM round-trips
+# a question took, how long each of them ran and, when streaming, the time to first token.
+class TurnTimingHandler(BaseCallbackHandler):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.first_token = None
+        self.retrievals = []
+        self.llm_calls = []
+        self._open = {}
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._open[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.retrievals.append(time.perf_counter() - self._open.pop(run_id, self.started))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._open[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._open[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.llm_calls.append(time.perf_counter() - self._open.pop(run_id, self.started))
+
+    def stop(self):
+        self.finished = time.perf_counter()
+        return self
+
+    @property
+    def total(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def as_dict(self):
+        return {"total_s": round(self.total, 3),
+                "retrievals": len(self.retrievals),
+                "retrieval_s": round(sum(self.retrievals), 3),
+                "llm_calls": len(self.llm_calls),
+                "llm_s": round(sum(self.llm_calls), 3),
+                "ttft_s": None if self.first_token is None else round(self.first_token - self.started, 3)}
+
+
+# Adds LLM token usage and streamed token counts to whichever span is current when the LLM runs
+class SpanCallbackHandler(BaseCallbackHandler):
+    def on_llm_new_token(self, token, **kwargs):
+        active = current_span()
+        if active is not None:
+            active.add(streamed_tokens=1)
+
+    def on_llm_end(self, response, **kwargs):
+        active = current_span()
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if active is not None and usage:
+            active.add(prompt_tokens=usage.get("prompt_tokens", 0),
+                       completion_tokens=usage.get("completion_tokens", 0))
+
+
+class StreamlitTokenHandler(BaseCallbackHandler):
+    # renders streamed tokens into a st.empty() placeholder as they arrive
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        self.placeholder.write(self.text + "▌")
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+from settings import get_setting
+
+# Local request tracing. A span times one step (pdf.load, embed, retrieval, ...) and carries
+# counters such as tokens or bytes. The outermost span of a request is its trace; when it ends it
+# is appended to TRACE_FILE as one JSON line and folded into the Prometheus-text aggregates.
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_metrics = {}
+_metrics_lock = threading.Lock()
+_server_lock = threading.Lock()
+_server = None
+
+
+class Span:
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.attributes = dict(attributes)
+        self.children = []
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self, duration=None):
+        self.duration = duration if duration is not None else time.perf_counter() - self._started
+
+    def _add_child(self, child):
+        with self._lock:
+            self.children.append(child)
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in list(self.children):
+            yield from child.walk(depth + 1)
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent.span_id if self.parent else None,
+                "name": self.name, "start": self.start,
+                "duration_ms": round((self.duration or 0.0) * 1000, 3),
+                "attributes": self.attributes}
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    parent = _current_span.get()
+    new_span = Span(name, parent, **attributes)
+    if parent is not None:
+        parent._add_child(new_span)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    finally:
+        new_span.end()
+        _current_span.reset(token)
+        if parent is None:
+            export_trace(new_span)
+
+
+# Adds an already finished step, e.g. timed in a worker process or thread, under parent
+# (default: the current span). Outside a trace this does nothing.
+def record_span(name, duration, parent=None, **attributes):
+    parent = parent or _current_span.get()
+    if parent is None:
+        return None
+    finished = Span(name, parent, **attributes)
+    finished.start -= duration
+    finished.end(duration)
+    parent._add_child(finished)
+    return finished
+
+
+def export_trace(root):
+    exporters = get_setting("TRACE_EXPORT", "jsonl")
+    if exporters == "none":
+        return
+    spans = [child.to_dict() for _, child in root.walk()]
+    if exporters in ("jsonl", "both"):
+        path = get_setting("TRACE_FILE", os.path.join(".cache", "traces.jsonl"))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps({"trace_id": root.trace_id, "name": root.name, "start": root.start,
+                                "duration_ms": spans[0]["duration_ms"], "spans": spans}) + "\n")
+    with _metrics_lock:
+        for item in spans:
+            metric = _metrics.setdefault(item["name"], {"count": 0, "seconds": 0.0, "counters": {}})
+            metric["count"] += 1
+            metric["seconds"] += item["duration_ms"] / 1000
+            for key, value in item["attributes"].items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric["counters"][key] = metric["counters"].get(key, 0) + value
+    if exporters in ("prometheus", "both"):
+        start_metrics_server(get_setting("TRACE_PROMETHEUS_PORT", 9464, int))
+
+
+def prometheus_text():
+    lines = ["# TYPE qa_span_duration_seconds summary"]
+    with _metrics_lock:
+        for name, metric in sorted(_metrics.items()):
+            lines.append(f'qa_span_duration_seconds_sum{{span="{name}"}} {metric["seconds"]:.6f}')
+            lines.append(f'qa_span_duration_seconds_count{{span="{name}"}} {metric["count"]}')
+        lines.append("# TYPE qa_span_attribute_total counter")
+        for name, metric in sorted(_metrics.items()):
+            for key, value in sorted(metric["counters"].items()):
+                lines.append(f'qa_span_attribute_total{{span="{name}",attribute="{key}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    # one /metrics endpoint per process, started with the first exported trace
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        except OSError as error:
+            print(f"metrics endpoint not started on port {port}: {error}")
+            _server = False
+            return
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+
+def show_trace_sidebar(root):
+    # debug panel with the span breakdown of the last request
+    if root is None or not get_setting("DEBUG_PANEL", True, bool):
+        return
+    with st.sidebar.expander(f"Debug: last request ({root.name}, {(root.duration or 0) * 1000:.0f} ms)"):
+        rows = []
+        for depth, item in root.walk():
+            rows.append({"span": " " * depth + item.name,
+                         "ms": round((item.duration or 0.0) * 1000, 1),
+                         "details": ", ".join(f"{key}={value}" for key, value in item.attributes.items())})
+        st.dataframe(rows, hide_index=True, use_container_width=True)
@@ -0,0 +1,397 @@
+import io
+import os
+import json
+import uuid
+import shutil
+import numpy as np
+from settings import get_setting
+
+# faiss, the Pinecone SDK and the langchain wrappers (faiss_store.py) are imported where they are
+# first needed, so listing agents doesn't load them
+
+CONFIG_FILE = "config.json"
+DOCSTORE_FILE = "docstore.json"
+VECTORS_FILE = "vectors.npy"
+INDEX_FILE = "index.faiss"
+# rewritten with a new token every time the builder saves an agent; the apps key their caches on it
+VERSION_FILE = "version.json"
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+# how vectors are held in the searchable index; vectors.npy always keeps the full float32 rows
+STORAGE_TYPES = ("float32", "float16", "int8", "pq")
+FACTORY_CODES = {"float16": "SQfp16", "int8": "SQ8"}
+MAX_TRAINING_VECTORS = 65536
+# share of tombstoned rows at which an HNSW agent is rebuilt without them
+COMPACT_FRACTION = 0.2
+
+
+# Both backends expose the same calls: list_indexes, create_index, open_index (an object with
+# Pinecone-style upsert/list/delete), save_index, checkpoint_index (cheap save of the upserts so far
+# for resuming a job), bump_index_version / index_version, local_path
+# (directory for files stored alongside the vectors) and get_vector_db (a langchain VectorStore).
+class PineconeBackend:
+    name = "pinecone"
+
+    def __init__(self):
+        from pinecone import Pinecone as pinecone_Pinecone
+        self.pc = pinecone_Pinecone(api_key=get_setting("PINECONE_API_KEY"))
+
+    def list_indexes(self):
+        return [index["name"] for index in self.pc.list_indexes()]
+
+    def create_index(self, name, dimension=1536):
+        from pinecone import ServerlessSpec
+        self.pc.create_index(name=name, metric="cosine", dimension=dimension,
+                             spec=ServerlessSpec(cloud='aws', region='us-west-2'))
+
+    def open_index(self, name):
+        return self.pc.Index(name)
+
+    def save_index(self, index):
+        pass
+
+    def checkpoint_index(self, index):
+        pass
+
+    def local_path(self, name):
+        # local files that go with a remote agent (e.g. its BM25 index)
+        return os.path.join(get_setting("PINECONE_LOCAL_DIR", os.path.join("indexes", "pinecone")), name)
+
+    def bump_index_version(self, name):
+        write_index_version(self.local_path(name))
+
+    def index_version(self, name):
+        # upserts are served live; the marker tells other processes the agent changed
+        return read_index_version(self.local_path(name))
+
+    def get_vector_db(self, name, embeddings):
+        from langchain.vectorstores import Pinecone
+        return Pinecone.from_existing_index(name, embeddings)
+
+
+def write_index_version(path):
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, VERSION_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": uuid.uuid4().hex}, f)
+    os.replace(tmp_path, os.path.join(path, VERSION_FILE))
+
+
+def read_index_version(path):
+    # None for agents no builder has saved since the marker was introduced
+    try:
+        with open(os.path.join(path, VERSION_FILE)) as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        return None
+
+
+def normalize(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def truncate_vectors(vectors, truncate_dim=None):
+    # Matryoshka-style: keep the leading dimensions and re-normalise. Only models trained for it
+    # (text-embedding-3-*) keep their quality; the exact rerank recovers most of it for others.
+    if not truncate_dim or truncate_dim >= vectors.shape[1]:
+        return vectors
+    return normalize(vectors[:, :truncate_dim])
+
+
+def pq_subquantizers(dimension, pq_m):
+    # PQ needs the dimension to split evenly into sub-vectors
+    return max(m for m in range(1, min(pq_m, dimension) + 1) if dimension % m == 0)
+
+
+def build_faiss_index(vectors, index_type="flat", ivf_nlist=1024, hnsw_m=32, storage="float32", pq_m=96):
+    import faiss
+    # vectors are L2-normalised, so inner product == cosine similarity (same metric as Pinecone)
+    dimension = vectors.shape[1]
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"FAISS_STORAGE must be one of {STORAGE_TYPES}, got {storage}")
+    if storage == "pq" and len(vectors) < 4 * 256:
+        # 256 centroids per sub-quantizer need enough training points (faiss suggests 39 per centroid)
+        print(f"only {len(vectors)} vectors, too few to train PQ; using int8 instead")
+        storage = "int8"
+    if not len(vectors):
+        storage = "float32"
+    code = "Flat" if storage == "float32" else FACTORY_CODES.get(storage) or f"PQ{pq_subquantizers(dimension, pq_m)}"
+    # IVF needs ~40 training points per list; small agents fall back to fewer lists
+    nlist = min(ivf_nlist, len(vectors) // 39)
+    if index_type == "hnsw":
+        description = f"HNSW{hnsw_m}" if code == "Flat" else f"HNSW{hnsw_m},{code}"
+    else:
+        # "np" skips polysemous training, which takes minutes and only helps Hamming-distance search
+        code = code + "np" if storage == "pq" else code
+        description = f"IVF{nlist},{code}" if index_type == "ivf" and nlist >= 1 else code
+    index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > MAX_TRAINING_VECTORS:
+            rows = np.random.default_rng(0).choice(len(vectors), MAX_TRAINING_VECTORS, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+
+def read_faiss_index(path):
+    import faiss
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        # not every index type can be memory-mapped (e.g. HNSW on older faiss builds)
+        return faiss.read_index(path)
+
+
+def set_search_params(index, config):
+    import faiss
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = config.get("ivf_nprobe", 16)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.get("hnsw_ef_search", 64)
+
+
+def append_rows(path, rows):
+    # grows a float32 .npy file in place: rows already on disk don't move, so readers' memory maps
+    # stay valid; falls back to rewriting the file when the longer shape no longer fits the header
+    rows = np.ascontiguousarray(rows, dtype=np.float32)
+    if os.path.exists(path):
+        with open(path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            shape, fortran_order, dtype = (np.lib.format.read_array_header_1_0(f) if version == (1, 0)
+                                           else np.lib.format.read_array_header_2_0(f))
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {"descr": "<f4", "fortran_order": False,
+                                                          "shape": (shape[0] + len(rows), rows.shape[1])})
+            if version == (1, 0) and dtype == np.float32 and not fortran_order and len(header.getvalue()) == f.tell():
+                f.seek(0, os.SEEK_END)
+                f.write(rows.tobytes())
+                f.flush()
+                f.seek(0)
+                f.write(header.getvalue())
+                return
+        rows = np.concatenate([np.load(path, mmap_mode="r"), rows])
+    write_rows(path, rows)
+
+
+def write_rows(path, rows):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(rows, dtype=np.float32))
+    os.replace(path + ".tmp", path)
+
+
+# One agent on local disk: vectors.npy (float32, memory-mapped), docstore.json (ids + metadata)
+# and index.faiss, whose labels are row numbers in vectors.npy. Upserts and deletes are buffered and
+# applied on save(), which appends the new rows to the existing index instead of rebuilding it.
+# Deleted or replaced rows are dropped from flat and IVF indexes by re-adding the remaining rows
+# with the trained quantizer; HNSW graphs can't drop nodes, so their rows stay as tombstones (id
+# None) that searches skip until they make up COMPACT_FRACTION of the agent. The index is trained
+# again only once the agent has doubled since its last training (IVF lists, int8 and PQ codebooks).
+class LocalFaissIndex:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.ids, self.metadatas = [], []
+        self.trained_rows = 0
+        docstore_path = os.path.join(path, DOCSTORE_FILE)
+        if os.path.exists(docstore_path):
+            with open(docstore_path) as f:
+                docstore = json.load(f)
+            self.ids, self.metadatas = docstore["ids"], docstore["metadatas"]
+            self.trained_rows = docstore.get("trained_rows", len(self.ids))
+        self.pending = {}
+        self.deleted = set()
+
+    @property
+    def tombstones(self):
+        return [row for row, vector_id in enumerate(self.ids) if vector_id is None]
+
+    def load_vectors(self):
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        if not os.path.exists(vectors_path):
+            return np.zeros((0, self.config["dimension"]), dtype=np.float32)
+        return np.load(vectors_path, mmap_mode="r")
+
+    def upsert(self, vectors):
+        for record in vectors:
+            # float32 rows instead of Python float lists keep the buffer ~8x smaller
+            self.pending[record["id"]] = (np.asarray(record["values"], dtype=np.float32), record.get("metadata", {}))
+            self.deleted.discard(record["id"])
+
+    def list(self, page_size=1000):
+        live = set(self.ids)
+        ids = [vector_id for vector_id in self.ids if vector_id is not None and vector_id not in self.deleted]
+        ids += [vector_id for vector_id in self.pending if vector_id not in live]
+        for start in range(0, len(ids), page_size):
+            yield ids[start:start + page_size]
+
+    def delete(self, ids):
+        for vector_id in ids:
+            self.pending.pop(vector_id, None)
+            self.deleted.add(vector_id)
+
+    def needs_training(self):
+        trained = self.config["index_type"] == "ivf" or self.config.get("storage", "float32") in ("int8", "pq")
+        live_rows = len(self.ids) - len(self.tombstones)
+        return trained and self.trained_rows < MAX_TRAINING_VECTORS and live_rows >= 2 * max(1, self.trained_rows)
+
+    def _apply_pending(self):
+        # replaced and deleted rows become tombstones; new and replaced rows are appended
+        rows = {vector_id: row for row, vector_id in enumerate(self.ids) if vector_id is not None}
+        for vector_id in list(self.deleted) + list(self.pending):
+            if vector_id in rows:
+                self.ids[rows[vector_id]] = self.metadatas[rows[vector_id]] = None
+        if self.pending:
+            append_rows(os.path.join(self.path, VECTORS_FILE),
+                        normalize([values for values, _ in self.pending.values()]))
+            self.ids += list(self.pending)
+            self.metadatas += [metadata for _, metadata in self.pending.values()]
+        self.pending, self.deleted = {}, set()
+
+    def _build_index(self, vectors):
+        return build_faiss_index(truncate_vectors(vectors, self.config.get("truncate_dim")),
+                                 self.config["index_type"], self.config.get("ivf_nlist", 1024),
+                                 self.config.get("hnsw_m", 32), self.config.get("storage", "float32"),
+                                 self.config.get("pq_m", 96))
+
+    def _compact(self, vectors):
+        # drops tombstoned rows, renumbering the rest
+        live = [row for row, vector_id in enumerate(self.ids) if vector_id is not None]
+        vectors = np.asarray(vectors[live], dtype=np.float32)
+        self.ids = [self.ids[row] for row in live]
+        self.metadatas = [self.metadatas[row] for row in live]
+        write_rows(os.path.join(self.path, VECTORS_FILE), vectors)
+        return vectors
+
+    def _update_index(self):
+        import faiss
+        index_path = os.path.join(self.path, INDEX_FILE)
+        vectors = self.load_vectors()
+        tombstones = len(self.tombstones)
+        index = faiss.read_index(index_path) if os.path.exists(index_path) else None
+        if index is not None and isinstance(index, faiss.IndexHNSW):
+            rebuild = tombstones > COMPACT_FRACTION * len(self.ids)
+        else:
+            rebuild = index is None
+        if rebuild or self.needs_training():
+            vectors = self._compact(vectors)
+            self.trained_rows = len(vectors)
+            return self._build_index(vectors)
+        if tombstones and not isinstance(index, faiss.IndexHNSW):
+            # flat and IVF indexes keep their trained quantizer and only re-encode the rows
+            vectors = self._compact(vectors)
+            index.reset()
+            start = 0
+        else:
+            start = index.ntotal
+        if len(vectors) > start:
+            index.add(truncate_vectors(np.asarray(vectors[start:], dtype=np.float32), self.config.get("truncate_dim")))
+        return index
+
+    def save(self):
+        import faiss
+        if not self.pending and not self.deleted:
+            return
+        self._apply_pending()
+        index = self._update_index()
+        # docstore.json is replaced last, so readers never see ids without their vectors
+        faiss.write_index(index, os.path.join(self.path, INDEX_FILE + ".tmp"))
+        os.replace(os.path.join(self.path, INDEX_FILE + ".tmp"), os.path.join(self.path, INDEX_FILE))
+        self._write_docstore()
+
+    def save_checkpoint(self):
+        # persists new rows for a resumed job without touching index.faiss, which save() brings up to
+        # date once at the end; replacements and deletes stay buffered until then
+        existing = set(self.ids)
+        new_ids = [vector_id for vector_id in self.pending if vector_id not in existing]
+        if not new_ids:
+            return
+        append_rows(os.path.join(self.path, VECTORS_FILE),
+                    normalize([self.pending[vector_id][0] for vector_id in new_ids]))
+        self.ids += new_ids
+        self.metadatas += [self.pending.pop(vector_id)[1] for vector_id in new_ids]
+        self._write_docstore()
+
+    def _write_docstore(self):
+        with open(os.path.join(self.path, DOCSTORE_FILE + ".tmp"), "w") as f:
+            json.dump({"ids": self.ids, "metadatas": self.metadatas, "trained_rows": self.trained_rows}, f)
+        os.replace(os.path.join(self.path, DOCSTORE_FILE + ".tmp"), os.path.join(self.path, DOCSTORE_FILE))
+
+
+class FaissBackend:
+    name = "faiss"
+
+    def __init__(self, root=None):
+        self.root = root or get_setting("FAISS_DIR", "indexes")
+        os.makedirs(self.root, exist_ok=True)
+
+    def list_indexes(self):
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, CONFIG_FILE)))
+
+    def create_index(self, name, dimension=1536):
+        index_type = get_setting("FAISS_INDEX_TYPE", "flat").lower()
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"FAISS_INDEX_TYPE must be one of {INDEX_TYPES}, got {index_type}")
+        storage = get_setting("FAISS_STORAGE", "float32").lower()
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"FAISS_STORAGE must be one of {STORAGE_TYPES}, got {storage}")
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        config = {"dimension": dimension, "index_type": index_type,
+                  "ivf_nlist": get_setting("FAISS_IVF_NLIST", 1024, int),
+                  "ivf_nprobe": get_setting("FAISS_IVF_NPROBE", 16, int),
+                  "hnsw_m": get_setting("FAISS_HNSW_M", 32, int),
+                  "hnsw_ef_search": get_setting("FAISS_HNSW_EF_SEARCH", 64, int),
+                  "storage": storage,
+                  "pq_m": get_setting("FAISS_PQ_M", 96, int),
+                  "truncate_dim": get_setting("FAISS_TRUNCATE_DIM", None, int),
+                  "rerank_factor": get_setting("FAISS_RERANK_FACTOR", 4, int)}
+        with open(os.path.join(path, CONFIG_FILE), "w") as f:
+            json.dump(config, f)
+
+    def delete_index(self, name):
+        shutil.rmtree(os.path.join(self.root, name))
+
+    def open_index(self, name):
+        return LocalFaissIndex(os.path.join(self.root, name))
+
+    def save_index(self, index):
+        index.save()
+
+    def checkpoint_index(self, index):
+        index.save_checkpoint()
+
+    def local_path(self, name):
+        return os.path.join(self.root, name)
+
+    def bump_index_version(self, name):
+        write_index_version(self.local_path(name))
+
+    def index_version(self, name):
+        return read_index_version(self.local_path(name))
+
+    def get_vector_db(self, name, embeddings):
+        from faiss_store import make_faiss_store
+        path = os.path.join(self.root, name)
+        local_index = LocalFaissIndex(path)
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            index = read_faiss_index(index_path)
+        else:
+            index = build_faiss_index(np.zeros((0, local_index.config["dimension"]), dtype=np.float32))
+        return make_faiss_store(embeddings, index, local_index)
+
+
+def get_vector_store_backend():
+    backend = get_setting("VECTOR_STORE", "pinecone").lower()
+    if backend == "faiss":
+        return FaissBackend()
+    if backend == "pinecone":
+        return PineconeBackend()
+    raise ValueError(f"Unknown VECTOR_STORE: {backend}")
@@ -0,0 +1,37 @@
+import time
+import threading
+import importlib
+from settings import get_setting
+
+# The apps import langchain, lida, pandas and faiss where they are first used, so the first page
+# renders without them. warm_up is called once the page has been drawn and imports them on a
+# background thread, so they are usually loaded before the user presses a button. Modules are
+# process-wide, so this happens once per server process rather than once per session.
+
+_requested = set()
+_lock = threading.Lock()
+
+
+def warm_up(modules):
+    if not get_setting("WARMUP", True, bool):
+        return None
+    with _lock:
+        modules = [name for name in modules if name not in _requested]
+        _requested.update(modules)
+    if not modules:
+        return None
+    thread = threading.Thread(target=import_modules, args=(modules,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def import_modules(modules):
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as error:
+            # an optional dependency that isn't installed fails again, with its real error, when used
+            print(f"warm-up import of {name} failed: {error!r}")
+            continue
+        print(f"warmed up {name} in {time.perf_counter() - started:.2f}s")